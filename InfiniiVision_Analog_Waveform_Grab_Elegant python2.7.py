@@ -38,6 +38,12 @@ import struct
 import numpy as np
 import scipy as sp
 import matplotlib.pyplot as plt
+import scopesession # Shared VISA sessions, see scopesession.py
+import waveform # Reads :WAVeform:DATA? straight into NumPy buffers, see waveform.py
+import wavearchive # Append-only capture archive, see wavearchive.py
+import csvexport # Streaming CSV writer, see csvexport.py
+import chunktune # Tuned VISA read sizes per address, see chunktune.py
+import digital # Bit-packed digital channel (POD) data, see digital.py
 
 ##############################################################################################################################################################################
 ##############################################################################################################################################################################
@@ -52,7 +58,7 @@ import matplotlib.pyplot as plt
 ## Keysight IO Libraries 17.1.19xxx was used.
 ## Anaconda Python 2.7.7 64 bit is used and recommended
 ## PyVisa 1.8 is used
-## Windows 7 Enterprise, 64 bit (has implications for time.clock if ported to unix type machine, use time.time instead)
+## Windows 7 Enterprise, 64 bit (timings use time.perf_counter, which replaces the deprecated time.clock; see benchmark_suite.py for repeatable ones)
 
 ## HiSlip and Socket connections not supported
 
@@ -96,6 +102,16 @@ SCOPE_VISA_ADDRESS = "USB0::0x0957::0x179B::MY51452776::0::INSTR" # Get this fro
 
 GLOBAL_TOUT = 10000 # IO time out in milliseconds
 
+## Vertical resolution needed, in bits
+REQUIRED_BITS = None
+    ## None keeps all the resolution the acquisition type delivers: BYTE format for Normal and Peak Detect (8 bit), WORD for High Res. and Average.
+    ## 8 makes every acquisition type use BYTE format, which halves the transfer time for High Res. and Average too.
+
+## Data type of the scaled waveforms in Wav_Data
+SCALED_DTYPE = np.float64
+    ## np.float32 halves the memory and file size; it keeps about 7 significant digits, which is more than the 16 bit WORD data has.
+    ## The raw codes and vertical pre-ambles are also kept in Waveforms (see waveform.Waveform) for scaling again later.
+
 ## Save Locations
 BASE_FILE_NAME = "my_data"
 BASE_DIRECTORY = "D:\\DATA\\"
@@ -117,14 +133,14 @@ sys.stdout.write("Script is running.  This may take a while...")
 
 ## Define VISA Resource Manager & Install directory
 ## This directory will need to be changed if VISA was installed somewhere else.
-rm = visa.ResourceManager('C:\\Windows\\System32\\visa32.dll') # this uses PyVisa
-## This is more or less ok too: rm = visa.ResourceManager('C:\\Program Files (x86)\\IVI Foundation\\VISA\\WinNT\\agvisa\\agbin\\visa32.dll')
-## In fact, it is generally not needed to call it explicitly: rm = visa.ResourceManager()
+scopesession.VISA_LIBRARY = 'C:\\Windows\\System32\\visa32.dll' # this uses PyVisa, through scopesession
+## This is more or less ok too: scopesession.VISA_LIBRARY = ('C:\\Program Files (x86)\\IVI Foundation\\VISA\\WinNT\\agvisa\\agbin\\visa32.dll')
+## In fact, it is generally not needed to set it explicitly: scopesession.VISA_LIBRARY = ''
 
 ## Open Connection
 ## Define & open the scope by the VISA address ; # This uses PyVisa
 try:
-    KsInfiniiVisionX = rm.open_resource(SCOPE_VISA_ADDRESS)
+    KsInfiniiVisionX = scopesession.open_session(SCOPE_VISA_ADDRESS, timeout=GLOBAL_TOUT)
 except Exception:
     print("Unable to connect to oscilloscope at " + str(SCOPE_VISA_ADDRESS) + ". Aborting script.\n")
     sys.exit()
@@ -186,34 +202,49 @@ CH_UNITS = ["BLANK", "BLANK", "BLANK", "BLANK"]
 ## The assumption here is that, if the channel is off, even if it has data behind it, data will not be retrieved from it.
 ## Note that this only has to be done once for repetitive acquisitions if the channel scales (and on/off) are not changed.
 
-KsInfiniiVisionX.write(":WAVeform:POINts:MODE MAX") # MAX mode works for all acquisition types, so this is done here to avoid Acq. Type vs points mode problems. Adjusted later for specific acquisition types.
+Channel_States = waveform.ChannelStateCache(KsInfiniiVisionX, len(CHS_LIST), verify=False)
+    ## Caches the display state, points, pre-amble and units of each channel. Setup commands below go through Channel_States.write() so it knows about them.
+    ## This script asks for the states once, so the cache does not check the setup (verify=False): the check would only add a query.
+    ## For repetitive acquisitions, make it with verify=True and call Channel_States.states() before each capture instead; that costs one query
+    ## while the setup is unchanged, and catches front panel changes too.
 
-ch = 1 # Channel number
-for each_value in CHS_LIST:
-    On_Off = int(KsInfiniiVisionX.query(":CHANnel" + str(ch) + ":DISPlay?")) # Is the channel displayed? If not, don't pull.
-    if On_Off == 1: # Only ask if needed... but... the scope can acquire waveform data even if the channel is off (in some cases) - so modify as needed
-        Channel_Acquired = int(KsInfiniiVisionX.query(":WAVeform:SOURce CHANnel" + str(ch) + ";POINts?")) # If this returns a zero, then this channel did not capture data and thus there are no points
-        ## Note that setting the :WAV:SOUR to some channel has the effect of turning it on
-    else:
-        Channel_Acquired = 0
+################################################################################################################
+## Setup data export - For repetitive acquisitions, this only needs to be done once unless settings are changed
+    ## This is done before getting the pre-ambles, since the Y INCrement and Y REFerence depend on the format.
+
+ACQ_TYPE = str(KsInfiniiVisionX.query(":ACQuire:TYPE?")).strip("\n")
+        ## This can also be done when pulling pre-ambles (pre[1]) or may be known ahead of time, but since the script is supposed to find everything, it is done now.
+WAVEFORM_FORMAT = waveform.choose_format(ACQ_TYPE, REQUIRED_BITS)
+    ## BYTE (8 bit) for Normal and Peak Detect, whose ADC data has 8 bits anyway - half the bytes of WORD, so about half the transfer time.
+    ## WORD (16 bit) for Average and High Res. Acq. Types, which can produce more than 8 bits of resolution, unless REQUIRED_BITS is 8 or less.
+waveform.configure_format(Channel_States, WAVEFORM_FORMAT)
+    ## Sends ":WAVeform:FORMat BYTE;BYTeorder LSBFirst;UNSigned 1" or ":WAVeform:FORMat WORD;BYTeorder LSBFirst;UNSigned 0"
+        ## BYTE data is read as unsigned 8 bit integers (uint8) and WORD data as signed 16 bit integers (int16); the scaling below handles both.
+        ## Going through Channel_States makes it ask for the pre-ambles again if the format changed.
+
+Channel_States.write(":WAVeform:POINts:MODE MAX") # MAX mode works for all acquisition types, so this is done here to avoid Acq. Type vs points mode problems. Adjusted later for specific acquisition types.
+
+for state in Channel_States.states():
+    ch = state.channel # Channel number
+    On_Off = int(state.displayed) # Is the channel displayed? If not, don't pull.
+    Channel_Acquired = state.points # If this is zero, then this channel did not capture data and thus there are no points
+        ## The cache only asks for the points (:WAVeform:SOURce CHANnelN;POINts?) if the channel is displayed, since setting the :WAV:SOUR to some channel has the effect of turning it on
     if Channel_Acquired == 0 or On_Off == 0: # Channel is off or no data acquired
-        KsInfiniiVisionX.write(":CHANnel" + str(ch) + ":DISPlay OFF") # Setting a channel to be a waveform source turns it on... so if here, turn it off.
+        Channel_States.write(":CHANnel" + str(ch) + ":DISPlay OFF") # Setting a channel to be a waveform source turns it on... so if here, turn it off.
         CHS_LIST[ch-1] = 0 # Recall that python indices start at 0, so ch1 is index 0
     else: # Channel is on AND data acquired
         CHS_LIST[ch-1] = 1 # After the CHS_LIST array is filled it could, for example look like: if chs 1,3 and 4 were on, CHS_LIST = [1,0,1,1]
         NUMBER_CHANNELS_ON += 1
-        ## Might as well get the pre-amble info now
-        Pre = KsInfiniiVisionX.query(":WAVeform:PREamble?").split(',') # ## The programmer's guide has a very good description of this, under the info on :WAVeform:PREamble.
-            ## In above line, the waveform source is already set; no need to reset it.
+        ## The pre-amble info comes with the channel state
+        Pre = state.preamble # ## The programmer's guide has a very good description of this, under the info on :WAVeform:PREamble.
         ANALOGVERTPRES[ch-1]  = float(Pre[7]) # Y INCrement, Voltage difference between data points; Could also be found with :WAVeform:YINCrement? after setting :WAVeform:SOURce
         ANALOGVERTPRES[ch+3]  = float(Pre[8]) # Y ORIGin, Voltage at center screen; Could also be found with :WAVeform:YORigin? after setting :WAVeform:SOURce
         ANALOGVERTPRES[ch+7]  = float(Pre[9]) # Y REFerence, Specifies the data point where y-origin occurs, always zero; Could also be found with :WAVeform:YREFerence? after setting :WAVeform:SOURce
         ## In most cases this will need to be done for each channel as the vertical scale and offset will differ. However,
             ## if the vertical scales and offset are identical, the values for one channel can be used for the others.
             ## For math waveforms, this should always be done.
-        CH_UNITS[ch-1] = str(KsInfiniiVisionX.query(":CHANnel" + str(ch) + ":UNITs?").strip('\n')) # This isn't really needed but is included for completeness
-    ch += 1
-del ch, each_value, On_Off, Channel_Acquired
+        CH_UNITS[ch-1] = state.units # This isn't really needed but is included for completeness
+del ch, state, On_Off, Channel_Acquired, Pre
 
 ##########################
 if NUMBER_CHANNELS_ON == 0:
@@ -252,14 +283,6 @@ del ch, each_value
 
 #####################################################
 
-################################################################################################################
-## Setup data export - For repetitive acquisitions, this only needs to be done once unless settings are changed
-
-KsInfiniiVisionX.write(":WAVeform:FORMat WORD") # 16 bit word format... or BYTE for 8 bit format - WORD recommended, see more comments below when the data is actually retrieved
-    ## WORD format especially  recommended  for Average and High Res. Acq. Types, which can produce more than 8 bits of resolution.
-KsInfiniiVisionX.write(":WAVeform:BYTeorder LSBFirst") # Explicitly set this to avoid confusion - only applies to WORD FORMat
-KsInfiniiVisionX.write(":WAVeform:UNSigned 0") # Explicitly set this to avoid confusion
-
 #####################################################################################################################################
 #####################################################################################################################################
 ## Set and get points to be retrieved - For repetitive acquisitions, this only needs to be done once unless scope settings are changed
@@ -268,8 +291,7 @@ KsInfiniiVisionX.write(":WAVeform:UNSigned 0") # Explicitly set this to avoid co
 #########################################################
 ## Determine Acquisition Type to set points mode properly
 
-ACQ_TYPE = str(KsInfiniiVisionX.query(":ACQuire:TYPE?")).strip("\n")
-        ## This can also be done when pulling pre-ambles (pre[1]) or may be known ahead of time, but since the script is supposed to find everything, it is done now.
+## ACQ_TYPE was found above, before setting the waveform format.
 if ACQ_TYPE == "AVER" or ACQ_TYPE == "HRES": # Don't need to check for both types of mnemonics like this: if ACQ_TYPE == "AVER" or ACQ_TYPE == "AVERage": becasue the scope ALWAYS returns the short form
     POINTS_MODE = "NORMal" # Use for Average and High Resoultion acquisition Types.
         ## If the :WAVeform:POINts:MODE is RAW, and the Acquisition Type is Average, the number of points available is 0. If :WAVeform:POINts:MODE is MAX, it may or may not return 0 points.
@@ -293,10 +315,10 @@ else:
 KsInfiniiVisionX.write(":WAVeform:SOURce CHANnel" + str(FIRST_CHANNEL_ON))
 
 ## The next line is similar to, but distinct from, the previously sent command ":WAVeform:POINts:MODE MAX".  This next command is one of the most important parts of this script.
-KsInfiniiVisionX.write(":WAVeform:POINts MAX") # This command sets the points mode to MAX AND ensures that the maximum # of points to be transferred is set, though they must still be on screen
+Channel_States.write(":WAVeform:POINts MAX") # This command sets the points mode to MAX AND ensures that the maximum # of points to be transferred is set, though they must still be on screen
 
 ## Since the ":WAVeform:POINts MAX" command above also changes the :POINts:MODE to MAXimum, which may or may not be a good thing, so change it to what is needed next.
-KsInfiniiVisionX.write(":WAVeform:POINts:MODE " + str(POINTS_MODE))
+Channel_States.write(":WAVeform:POINts:MODE " + str(POINTS_MODE))
 ## If measurements are also being made, they are made on the "measurement record."  This record can be accessed by using:
     ## :WAVeform:POINts:MODE NORMal instead of :WAVeform:POINts:MODE RAW
     ## Please refer to the progammer's guide for more details on :WAV:POIN:MODE RAW/NORMal/MAX
@@ -325,7 +347,7 @@ if USER_REQUESTED_POINTS > MAX_CURRENTLY_AVAILABLE_POINTS or ACQ_TYPE == "PEAK":
 
 ## If one wants some other number of points...
 ## Tell it how many points you want
-KsInfiniiVisionX.write(":WAVeform:POINts " + str(USER_REQUESTED_POINTS))
+Channel_States.write(":WAVeform:POINts " + str(USER_REQUESTED_POINTS))
 
 ## Then ask how many points it will actually give you, as it may not give you exactly what you want.
 NUMBER_OF_POINTS_TO_ACTUALLY_RETRIEVE = int(KsInfiniiVisionX.query(":WAVeform:POINts?"))
@@ -388,10 +410,13 @@ del Pre
     ## This is the same for all channels.
     ## For repetitive acquisitions, it only needs to be done once unless settings change.
 
-DataTime = ((np.linspace(0,NUMBER_OF_POINTS_TO_ACTUALLY_RETRIEVE-1,NUMBER_OF_POINTS_TO_ACTUALLY_RETRIEVE)-X_REFerence)*X_INCrement)+X_ORIGin
 if ACQ_TYPE == "PEAK": # This means Peak Detect Acq. Type
-    DataTime = np.repeat(DataTime,2)
+    DataTime = waveform.TimeAxis(NUMBER_OF_POINTS_TO_ACTUALLY_RETRIEVE, X_INCrement, X_ORIGin, X_REFerence, repeat=2)
     ##  The points come out as Low(time1),High(time1),Low(time2),High(time2)....
+else:
+    DataTime = waveform.TimeAxis(NUMBER_OF_POINTS_TO_ACTUALLY_RETRIEVE, X_INCrement, X_ORIGin, X_REFerence)
+    ## DataTime[i] = ((i - X_REFerence) * X_INCrement) + X_ORIGin, computed only when asked for, so the time axis takes no memory.
+        ## DataTime[1000:2000] gives those times as an array, DataTime.searchsorted(t) or DataTime.index_of(t) the index of a time, DataTime.to_array() the whole axis.
     ### SEE IMPORTANT NOTE ABOUT PEAK DETECT AT VERY END, specific to fast time scales
 
 #####################################################################################################################################
@@ -400,10 +425,10 @@ if ACQ_TYPE == "PEAK": # This means Peak Detect Acq. Type
     ## Obviously there are numerous ways to actually place data  into an array... this is just one
 
 if ACQ_TYPE == "PEAK": # This means peak detect mode ### SEE IMPORTANT NOTE ABOUT PEAK DETECT MODE AT VERY END, specific to fast time scales
-    Wav_Data = np.zeros([2*NUMBER_OF_POINTS_TO_ACTUALLY_RETRIEVE,NUMBER_CHANNELS_ON])
+    Wav_Data = np.zeros([2*NUMBER_OF_POINTS_TO_ACTUALLY_RETRIEVE,NUMBER_CHANNELS_ON], dtype=SCALED_DTYPE)
     ## Peak detect mode returns twice as many points as the points query, one point each for LOW and HIGH values
 else: # For all other acquistion modes
-    Wav_Data = np.zeros([NUMBER_OF_POINTS_TO_ACTUALLY_RETRIEVE,NUMBER_CHANNELS_ON])
+    Wav_Data = np.zeros([NUMBER_OF_POINTS_TO_ACTUALLY_RETRIEVE,NUMBER_CHANNELS_ON], dtype=SCALED_DTYPE)
 
 ###################################################################################################
 ###################################################################################################
@@ -413,7 +438,7 @@ else: # For all other acquistion modes
     ## However, the benefit in Python is that the transfers can take less time, particularly longer ones.
 
 ## Get the waveform format
-WFORM = str(KsInfiniiVisionX.query(":WAVeform:FORMat?"))
+WFORM = str(KsInfiniiVisionX.query(":WAVeform:FORMat?")).strip()
 if WFORM == "BYTE":
     FORMAT_MULTIPLIER = 1
 else: #WFORM == "WORD"
@@ -432,11 +457,14 @@ TOTAL_BYTES_TO_XFER = POINTS_MULTIPLIER * NUMBER_OF_POINTS_TO_ACTUALLY_RETRIEVE
 ## Set chunk size:
     ## More info @ http://pyvisa.readthedocs.io/en/stable/resources.html
 if TOTAL_BYTES_TO_XFER >= 400000:
-    KsInfiniiVisionX.chunk_size = TOTAL_BYTES_TO_XFER
-## else:
-    ## use default size, which is 20480
+    CHUNK_SIZE = chunktune.chunk_size_for(KsInfiniiVisionX, TOTAL_BYTES_TO_XFER)
+else:
+    CHUNK_SIZE = chunktune.chunk_size_for(KsInfiniiVisionX, 20480) # PyVisa's default size
+    ## The chunk size is only used for the waveform reads themselves; the session's own chunk size is left alone, so other queries are not slowed down.
 
-## Any given user may want to tweak this for best throughput, if desired.  The 400,000 was chosen after testing various chunk sizes over various transfer sizes, over USB,
+## If this scope's VISA address has been tuned (run "python chunktune.py <VISA address>" once, with the scope set up for a typical capture), the tuned size is used.
+    ## The tuner measures the throughput of several chunk sizes on this address and keeps the best in a file, since USB, LAN (VXI-11, HiSLIP, sockets) and GPIB all behave differently.
+## Otherwise, the 400,000 was chosen after testing various chunk sizes over various transfer sizes, over USB,
     ## and determined to be the best, or at least simplest, cutoff.  When the transfers are smaller, the intrinsic "latencies" seem to dominate, and the default chunk size works fine.
 
 ## How does the default chuck size work?
@@ -452,54 +480,79 @@ if TOTAL_BYTES_TO_XFER >= 400000:
 #####################################################
 ## Pull waveform data, scale it
 
-now = time.clock() # Only to show how long it takes to transfer and scale the data.
-i  = 0 # index of Wav_data, recall that python indices start at 0, so ch1 is index 0
-for channel_number in CHS_ON:
-        ## Gets the waveform in 16 bit WORD format
-    ## The below method uses an IEEE488.2 compliant definite length binary block transfer invoked by :WAVeform:DATA?.
-        ## ASCII transfers are also possible, but MUCH slower.
-        Wav_Data[:,i] = np.array(KsInfiniiVisionX.query_binary_values(':WAVeform:SOURce CHANnel' + str(channel_number) + ';DATA?', "h", False)) # See also: https://PyVisa.readthedocs.io/en/stable/rvalues.html#reading-binary-values
-        ## Here, WORD format, LSBF, and signed integers are used (these are the scope settings in this script).  The query_binary_values function must be setup the same (https://docs.python.org/2/library/struct.html#format-characters):
-            ## For BYTE format and unsigned, use "b" instead of "h"; b is a signed char; see link from above line
-            ## For BYTE format and signed,   use "B" instead of "h"; B is an unsigned char
-            ## For WORD format and unsigned, use "h"; h is a short
-            ## For WORD format and signed,   use "H" instead of "h"; H is an unsigned short
-            ## For MSBFirst use True (Don't use MSBFirst unless that is the computer architecture - most common WinTel are LSBF - see sys.byteorder @ https://docs.python.org/2/library/sys.html)
-
-         ## WORD is more accurate, but slower for long records, say over 100 kPts.
-         ## WORD strongly suggested for Average and High Res. Acquisition Types.
-
-        ## query_binary_values() is a PyVisa specific IEEE 488.2 binary block reader.  Most languages have a similar function.
-            ## The InfiniiVision and InfiniiVision-X scopes always return a definite length binary block in response to the :WAVeform:DATA? querry
-            ## query_binary_values() does also read the termination character, but this is not always the case in other languages (MATLAB, for example)
-                ## In that case, another read is needed to read the termination character (or a device clear).
-            ## In the case of Keysight VISA (IO Libraries), the default termination character is '\n' but this can be changed, depending on the interface....
-                ## For more on termination characters: https://PyVisa.readthedocs.io/en/stable/resources.html#termination-characters
-
-        ## Notice that the waveform source is specified, and the actual data query is concatenated into one line with a semi-colon (;) essentially like this:
-            ## :WAVeform:SOURce CHANnel1;DATA?
-            ## This makes it "go" a little faster.
-
-        ## When the data is being exported w/ :WAVeform:DATA?, the oscilloscope front panel knobs don't work; they are blocked like :DIGitize, and the actions take effect AFTER the data transfer is complete.
-        ## The :WAVeform:DATA? query can be interrupted without an error by doing a device clear: KsInfiniiVisionX.clear()
-
-        ## Scales the waveform
-        ## One could just save off the preamble factors and post process this later.
-        Wav_Data[:,i] = ((Wav_Data[:,i]-ANALOGVERTPRES[channel_number+7])*ANALOGVERTPRES[channel_number-1])+ANALOGVERTPRES[channel_number+3]
-            ## For clarity: Scaled_waveform_Data[*] = [(Unscaled_Waveform_Data[*] - Y_reference) * Y_increment] + Y_origin
-
-        i +=1
-
-## Reset the chunk size back to default if needed.
-if TOTAL_BYTES_TO_XFER >= 400000:
-    KsInfiniiVisionX.chunk_size = 20480
-    ## If you don't do this, and now wanted to do something else... such as ask for a measurement result, and leave the chunk size set to something large,
-        ## it can really slow down the script, so set it back to default, which works well.
-
-del i, channel_number
-print ("\n\nIt took " + str(time.clock() - now) + " seconds to transfer and scale " + str(NUMBER_CHANNELS_ON) + " channel(s). Each channel had " + str(NUMBER_OF_POINTS_TO_ACTUALLY_RETRIEVE) + " points.\n")
+now = time.perf_counter() # Only to show how long it takes to transfer and scale the data.
+Raw_Data = waveform.allocate_waveform_buffer(POINTS_MULTIPLIER*NUMBER_OF_POINTS_TO_ACTUALLY_RETRIEVE, NUMBER_CHANNELS_ON, WFORM)
+    ## Raw sample codes, one row per channel, in the :WAVeform:FORMat read above (uint8 for BYTE, int16 for WORD, as set in this script)
+Waveforms = [None] * NUMBER_CHANNELS_ON # One waveform.Waveform (raw codes + vertical pre-amble) per channel in CHS_ON
+
+def Scale_Channel(i, source, codes): # i is the index of Wav_data, recall that python indices start at 0, so ch1 is index 0
+    ## Runs on a worker thread, while the next channel is already being transferred
+    channel_number = CHS_ON[i]
+    ## Scales the waveform
+    ## One could just save off the preamble factors and post process this later.
+    Waveforms[i] = waveform.Waveform(codes, ANALOGVERTPRES[channel_number-1], ANALOGVERTPRES[channel_number+3], ANALOGVERTPRES[channel_number+7], CH_UNITS[channel_number-1], source)
+    Waveforms[i].scaled(out=Wav_Data[:,i])
+        ## For clarity: Scaled_waveform_Data[*] = [(Unscaled_Waveform_Data[*] - Y_reference) * Y_increment] + Y_origin
+        ## This is written straight into the Wav_Data column, without full size temporaries.
+        ## Anything else to do per channel (e.g. writing it to disk) can go here too, and is then hidden behind the transfer of the next channel.
+
+waveform.fetch_pipelined(KsInfiniiVisionX, ["CHANnel" + str(channel_number) for channel_number in CHS_ON], Scale_Channel, Raw_Data, CHUNK_SIZE)
+    ## Pulls the channels one after another on this thread and hands each to Scale_Channel on a worker thread, with at most 2 channels waiting in between.
+    ## Raw_Data has a row per channel, so all the raw codes are kept; for long runs of captures, use a waveform.BufferPool instead to reuse a few buffers.
+    ## Gets the waveform in 8 bit BYTE or 16 bit WORD format, as chosen above
+## The below method uses an IEEE488.2 compliant definite length binary block transfer invoked by :WAVeform:DATA?.
+    ## ASCII transfers are also possible, but MUCH slower.
+    ## Each block is read chunk by chunk straight into that channel's row of the preallocated Raw_Data; no Python list of samples is built.
+        ## Old method, which unpacks every sample into a Python int first (about 10x the memory of the data itself at 8 MPts):
+        ## Wav_Data[:,i] = np.array(KsInfiniiVisionX.query_binary_values(':WAVeform:SOURce CHANnel' + str(channel_number) + ';DATA?', "h", False)) # See also: https://PyVisa.readthedocs.io/en/stable/rvalues.html#reading-binary-values
+    ## With the old method, WORD format, LSBF, and signed integers were used.  The query_binary_values function must be setup the same (https://docs.python.org/2/library/struct.html#format-characters):
+        ## For BYTE format and unsigned, use "b" instead of "h"; b is a signed char; see link from above line
+        ## For BYTE format and signed,   use "B" instead of "h"; B is an unsigned char
+        ## For WORD format and unsigned, use "h"; h is a short
+        ## For WORD format and signed,   use "H" instead of "h"; H is an unsigned short
+        ## For MSBFirst use True (Don't use MSBFirst unless that is the computer architecture - most common WinTel are LSBF - see sys.byteorder @ https://docs.python.org/2/library/sys.html)
+
+     ## WORD is more accurate, but slower for long records, say over 100 kPts.
+     ## WORD strongly suggested for Average and High Res. Acquisition Types.
+
+    ## query_binary_values() is a PyVisa specific IEEE 488.2 binary block reader.  Most languages have a similar function.
+        ## The InfiniiVision and InfiniiVision-X scopes always return a definite length binary block in response to the :WAVeform:DATA? querry
+        ## query_binary_values() does also read the termination character, but this is not always the case in other languages (MATLAB, for example)
+            ## In that case, another read is needed to read the termination character (or a device clear).
+        ## In the case of Keysight VISA (IO Libraries), the default termination character is '\n' but this can be changed, depending on the interface....
+            ## For more on termination characters: https://PyVisa.readthedocs.io/en/stable/resources.html#termination-characters
+
+    ## Notice that the waveform source is specified, and the actual data query is concatenated into one line with a semi-colon (;) essentially like this:
+        ## :WAVeform:SOURce CHANnel1;DATA?
+        ## This makes it "go" a little faster.
+
+    ## When the data is being exported w/ :WAVeform:DATA?, the oscilloscope front panel knobs don't work; they are blocked like :DIGitize, and the actions take effect AFTER the data transfer is complete.
+    ## The :WAVeform:DATA? query can be interrupted without an error by doing a device clear: KsInfiniiVisionX.clear()
+
+
+## The session's chunk size was never changed, so there is nothing to reset.
+    ## Had it been set to something large and left that way, asking for something else... such as a measurement result, can really slow down the script.
+
+del Scale_Channel, CHUNK_SIZE
+print ("\n\nIt took " + str(time.perf_counter() - now) + " seconds to transfer and scale " + str(NUMBER_CHANNELS_ON) + " channel(s). Each channel had " + str(NUMBER_OF_POINTS_TO_ACTUALLY_RETRIEVE) + " points.\n")
 del now
 
+#####################################################
+#####################################################
+## Pull digital channel (D0-D15) data - mixed signal (MSO) models only
+
+if MODEL.startswith("MSO"):
+    PODS_ON = digital.pods_on(KsInfiniiVisionX) # POD1 is D0-D7, POD2 is D8-D15; for example [1, 2] if both are displayed
+else:
+    PODS_ON = []
+if len(PODS_ON) > 0:
+    Digital_Data = digital.fetch_pods(KsInfiniiVisionX, PODS_ON)
+        ## Each pod is pulled in BYTE format, one byte (8 channels) per point, and kept bit-packed: Digital_Data.packed has shape (points, 2), 2 bytes per point for all 16 channels.
+            ## That is 1/16 of the memory of one uint8 per channel and point, and 1/64 of float64.
+        ## Digital_Data.bit(n) gives channel Dn as 0/1, Digital_Data.unpack() all 16 channels as a (16, points) array, and
+            ## Digital_Data.edges(n, "rising") / Digital_Data.edge_times(n, "rising") the indices / times where Dn goes high.
+    print("Pulled digital pod(s) " + str(PODS_ON) + ", " + str(len(Digital_Data)) + " points.\n")
+
 ###################################################################
 ###################################################################
 ## Done with scope operations - Close Connection to scope properly
@@ -530,13 +583,15 @@ for channel_number in CHS_ON:
 del channel_number
 
 ## Save data
-now = time.clock() # Only to show how long it takes to save
+now = time.perf_counter() # Only to show how long it takes to save
 filename = BASE_DIRECTORY + BASE_FILE_NAME + ".csv"
 with open(filename, 'w') as filehandle: # w means open for writing; can overwrite
     filehandle.write(header)
-    np.savetxt(filehandle, np.insert(Wav_Data,0,DataTime,axis=1), delimiter=',')
-        ## The np.insert essentially deals with the fact that Wav_Data is a multi-dimensional array and DataTime is a 1 1D array, and cannot otherwise be concatenated easily.
-print ("It took " + str(time.clock() - now) + " seconds to save " + str(NUMBER_CHANNELS_ON) + " channels and the time axis in csv format. Each channel had " + str(NUMBER_OF_POINTS_TO_ACTUALLY_RETRIEVE) + " points.\n")
+    csvexport.write_csv(filehandle, [DataTime] + Waveforms, delimiter=',')
+        ## Writes the same text as np.savetxt(filehandle, np.insert(Wav_Data,0,DataTime.to_array(),axis=1), delimiter=','), 3-4x faster for long records,
+            ## without the full size copy np.insert makes; the rows are formatted and written a block at a time.
+        ## Each channel's values are formatted once per distinct code (there are at most 65536), not once per point.
+print ("It took " + str(time.perf_counter() - now) + " seconds to save " + str(NUMBER_CHANNELS_ON) + " channels and the time axis in csv format. Each channel had " + str(NUMBER_OF_POINTS_TO_ACTUALLY_RETRIEVE) + " points.\n")
 del now
 
 ## Read csv data back into python with:
@@ -548,13 +603,16 @@ print('CSV data has been recalled into "recalled_csv_data".\n')
 ########################################################
 ## As a NUMPY BINARY file - fast and small, but really only good for python - can't use header
 ########################################################
-now = time.clock() # Only to show how long it takes to save
+now = time.perf_counter() # Only to show how long it takes to save
 filename = BASE_DIRECTORY + BASE_FILE_NAME + ".npy"
 with open(filename, 'wb') as filehandle: # wb means open for writing in binary; can overwrite
-    np.save(filehandle, np.insert(Wav_Data,0,DataTime,axis=1))
-print ("It took " + str(time.clock() - now) + " seconds to save " + str(NUMBER_CHANNELS_ON) + " channels and the time axis in binary format. Each channel had " + str(NUMBER_OF_POINTS_TO_ACTUALLY_RETRIEVE) + " points.\n")
+    np.save(filehandle, np.insert(Wav_Data,0,DataTime.to_array(),axis=1))
+print ("It took " + str(time.perf_counter() - now) + " seconds to save " + str(NUMBER_CHANNELS_ON) + " channels and the time axis in binary format. Each channel had " + str(NUMBER_OF_POINTS_TO_ACTUALLY_RETRIEVE) + " points.\n")
 del now
 
+if len(PODS_ON) > 0:
+    np.save(BASE_DIRECTORY + BASE_FILE_NAME + "_digital.npy", Digital_Data.packed) # Still bit-packed; read back with digital.DigitalCapture(np.load(...))
+
 ## Read the NUMPY BINARY data back into python with:
 with open(filename, 'rb') as filehandle: # rb means open for reading binary
     recalled_NPY_data = np.load(filehandle)
@@ -565,6 +623,57 @@ del filename, filehandle
 print('Binary data has been recalled into "recalled_NPY_data".\n')
 print('Binary saves are MUCH faster than CSV.\n')
 
+########################################################
+## Appended to a CAPTURE ARCHIVE - raw codes + pre-ambles, for many repetitive acquisitions
+## Codes are stored as 16 bit integers (BYTE codes are widened), 2 bytes per point per channel and no time column:
+    ## at most a quarter of the size of the .npy file above with SCALED_DTYPE = np.float64, at most half with np.float32
+########################################################
+now = time.perf_counter() # Only to show how long it takes to save
+Archive = wavearchive.WaveformArchive(BASE_DIRECTORY + BASE_FILE_NAME + "_archive") # Creates my_data_archive.raw and my_data_archive.idx, or appends to them
+Capture_Number = Archive.append(Waveforms, X_INCrement, X_ORIGin, X_REFerence, acq_type=ACQ_TYPE) # The acquisition type is kept, so PEAK captures come back with their Low,High pairing
+print ("It took " + str(time.perf_counter() - now) + " seconds to append capture " + str(Capture_Number) + " to the archive.\n")
+del now
+
+## Read any capture back, without loading the whole archive, with:
+recalled_capture = Archive[Capture_Number] # Archive[0] is the first capture, Archive[-1] the last; len(Archive) is the number of captures
+    ## recalled_capture.waveforms[0].scaled() gives the first channel in volts; recalled_capture.waveforms[0].codes is a memory map of the raw codes
+    ## recalled_capture.time_axis is a waveform.TimeAxis for the capture (both values of each PEAK Low,High pair get the same time); recalled_capture.acq_type is e.g. "PEAK"
+    ## Archive.index["timestamp"] gives the capture times of every capture
+del Capture_Number
+print('The capture has been recalled into "recalled_capture".\n')
+
+########################################################
+## Measurements - computed here from the downloaded data, see wavemeasure.py
+########################################################
+## Instead of asking the scope for VMAX, VPP, FREQuency, ... one channel at a time (measurev.analyze()), all channels are measured in one go from the raw codes:
+#import wavemeasure
+#Measurements = wavemeasure.measure_waveforms(Waveforms, X_INCrement) # Measurements["FREQuency"][i] is the frequency of channel CHS_ON[i]; also RISetime, FALLtime, DUTYcycle, ...
+#    ## The whole archive can be re-measured offline, batch after batch of captures, with: wavemeasure.measure_archive(Archive)
+
+########################################################
+## Spectrum - like the scope's FFT math function, in dBV, see spectrum.py
+########################################################
+## All channels are windowed and transformed in one call; Wav_Data.T has a row per channel:
+#import spectrum
+#Frequencies, Spectrum_Vrms = spectrum.spectrum(Wav_Data.T, X_INCrement, "hann") # "flattop" for accurate amplitudes, "rectangular", "hamming", "blackman"
+#for i in range(NUMBER_CHANNELS_ON):
+#    plt.plot(Frequencies, spectrum.dbv(Spectrum_Vrms[i]), label="Channel " + str(CHS_ON[i]))
+#plt.xlabel("Frequency (Hz)"); plt.ylabel("dBV"); plt.legend(); plt.show()
+#    ## For a long series of captures, average them as they come with Averager = spectrum.WelchAverager(X_INCrement, segment=65536), then Averager.add(Wav_Data.T) per capture;
+#    ## Averager.dbv() is the averaged spectrum and Averager.psd the noise density in V^2/Hz. spectrum.average_spectrum() averages a stack of captures already in memory.
+
+########################################################
+## Plotting - decimated to the width of the plot, see decimate.py
+########################################################
+## Plotting millions of points per channel is unusably slow, and just taking every Nth point can hide glitches.
+    ## decimate.for_display() reduces each channel to a min and a max per pixel column (every glitch stays visible), so plotting takes as long for 8 MPts as for 2000 points:
+#import decimate
+#for i in range(NUMBER_CHANNELS_ON):
+#    x, y = decimate.for_display(Waveforms[i], 1920, DataTime, peak=(ACQ_TYPE == "PEAK")) # 1920 = plot width in pixels; method="lttb" gives one point per pixel column instead
+#    plt.plot(x, y, label="Channel " + str(CHS_ON[i]))
+#plt.legend()
+#plt.show()
+
 ##############################################################################################################################################################################
 
 ##############################################################################################################################################################################
@@ -672,6 +781,23 @@ print('Binary saves are MUCH faster than CSV.\n')
 #KsInfiniiVisionX.write(":TIMebase:MODE MAIN")
 #    ## Note that if the zoom window is turned back on, it will revert to the last zoomed settings it had, not default
 
+##############################################################################################################################################################################
+##############################################################################################################################################################################
+## Addendum 3, For catching many triggers (bursts) with SEGMENTED memory
+##############################################################################################################################################################################
+##############################################################################################################################################################################
+
+## Instead of re-running this script for every trigger, the scope can capture N triggers back to back into segments of its memory, at its own trigger rate,
+    ## and all of them are then pulled in one go. See segmented.py. This replaces everything in the main script from "Setup data export" onwards:
+
+#import segmented
+#SEGMENT_COUNT = 100
+#Segments = segmented.capture_segmented(KsInfiniiVisionX, ["CHANnel" + str(ch) for ch in CHS_ON], SEGMENT_COUNT, WAVEFORM_FORMAT, timeout=60)
+#    ## Segments.codes["CHANnel1"] has shape (segments, points), raw codes; Segments.waveforms["CHANnel1"].scaled() gives volts in the same shape
+#    ## Segments.time_tags[n] is the trigger time of segment n+1, relative to the first; Segments.time_axis is the time axis within each segment
+#    ## :WAVeform:SEGMented:ALL ON is used to pull all segments of a channel in one :DATA? query where the scope supports it, otherwise one query per segment.
+#segmented.configure_realtime(KsInfiniiVisionX) # Set the scope back to normal acquisitions when done
+
 ##############################################################################################################################################################################
 ##############################################################################################################################################################################
 ## IMPORTANT NOTE ABOUT PEAK DETECT - at fast time scales
@@ -0,0 +1,93 @@
+# *********************************************************
+# asyncio versions of the measurev command/query helpers.
+# The blocking VISA calls run in an executor, one writer at a
+# time per instrument, so one event loop can drive many
+# oscilloscopes alongside GUI and logging tasks.
+# *********************************************************
+# Import modules.
+# ---------------------------------------------------------
+import asyncio
+import functools
+import measurev
+import scopesession
+
+
+# =========================================================
+# Seconds left until an asyncio deadline (None = no limit):
+# =========================================================
+def _remaining(loop, deadline):
+    if deadline is None:
+        return None
+    return max(0.0, deadline - loop.time())
+
+
+# =========================================================
+# One oscilloscope driven from the event loop:
+# =========================================================
+class AsyncInstrument(object):
+    def __init__(self, session, executor=None):
+        self.session = session
+        self.executor = executor  # None uses the loop's default executor.
+        self._lock = None
+        self._lock_loop = None  # Loop the writer lock was made on
+
+    # Runs a measurev function in the executor with this instrument
+    # bound.  timeout is in seconds and covers both the wait for the
+    # writer lock and the IO itself.  If it expires the VISA call is
+    # left to finish (bounded by the session's own IO timeout); the
+    # session lock keeps the next call from overlapping it.
+    async def call(self, function, *args, timeout=None):
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        if self._lock_loop is not loop:
+            # A lock belongs to one loop; a new loop (e.g. another
+            # asyncio.run()) gets a new lock, made here on that loop.
+            (self._lock, self._lock_loop) = (asyncio.Lock(), loop)
+
+        await asyncio.wait_for(self._lock.acquire(), _remaining(loop, deadline))
+        try:
+            future = loop.run_in_executor(
+                self.executor, functools.partial(self._run, function, *args))
+            return await asyncio.wait_for(future, _remaining(loop, deadline))
+        finally:
+            self._lock.release()
+
+    def _run(self, function, *args):
+        with measurev.using_instrument(self.session):
+            return function(*args)
+
+    async def command(self, command, hide_params=False, timeout=None):
+        return await self.call(measurev.do_command, command, hide_params, timeout=timeout)
+
+    async def command_ieee_block(self, command, values, timeout=None):
+        return await self.call(measurev.do_command_ieee_block, command, values, timeout=timeout)
+
+    async def query_string(self, query, timeout=None):
+        return await self.call(measurev.do_query_string, query, timeout=timeout)
+
+    async def query_number(self, query, timeout=None):
+        return await self.call(measurev.do_query_number, query, timeout=timeout)
+
+    async def query_ieee_block(self, query, timeout=None):
+        return await self.call(measurev.do_query_ieee_block, query, timeout=timeout)
+
+    async def query_measurements(self, names, source=None, timeout=None):
+        return await self.call(measurev.do_query_measurements, names, source, timeout=timeout)
+
+    async def acquisition_running(self, timeout=None):
+        return await self.call(measurev.acquisition_running, timeout=timeout)
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.session.close)
+
+
+# =========================================================
+# Open (or reuse) the shared session without blocking the loop:
+# =========================================================
+async def open_instrument(address=scopesession.DEFAULT_VISA_ADDRESS,
+                          timeout=scopesession.DEFAULT_TIMEOUT, executor=None):
+    loop = asyncio.get_running_loop()
+    session = await loop.run_in_executor(
+        executor, functools.partial(scopesession.open_session, address, timeout))
+    return AsyncInstrument(session, executor)
@@ -0,0 +1,69 @@
+# *********************************************************
+# Compares the grab script's CSV save,
+# np.savetxt(np.insert(Wav_Data, 0, DataTime, axis=1)),
+# with csvexport.write_csv() over a waveform.TimeAxis and the
+# raw waveforms, for 4 channels of simulated WORD data.  Both
+# files are checked to be identical.
+#
+# Usage: python benchmark_csv_export.py [points ...]
+# *********************************************************
+# Import modules.
+# ---------------------------------------------------------
+import filecmp
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import csvexport
+import simscope
+import waveform
+
+DEFAULT_POINTS = [1000, 10000, 100000, 1000000, 8000000]
+CHANNELS = 4
+
+
+# =========================================================
+# Simulated capture: time axis, raw waveforms, scaled Wav_Data
+# =========================================================
+def make_capture(points):
+    scope = simscope.SimulatedScope(points=points, channels=CHANNELS)
+    preamble = scope._preamble()
+    DataTime = waveform.TimeAxis.from_preamble(preamble)
+    Waveforms = [waveform.Waveform.from_preamble(scope.waveform_codes(channel, "WORD"), preamble)
+                 for channel in range(1, CHANNELS + 1)]
+    Wav_Data = np.zeros([points, CHANNELS])
+    for (i, wave) in enumerate(Waveforms):
+        wave.scaled(out=Wav_Data[:, i])
+    return DataTime, Waveforms, Wav_Data
+
+
+def save_old(filename, DataTime, Waveforms, Wav_Data):
+    with open(filename, 'w') as filehandle:
+        np.savetxt(filehandle, np.insert(Wav_Data, 0, DataTime.to_array(), axis=1), delimiter=',')
+
+
+def save_new(filename, DataTime, Waveforms, Wav_Data):
+    with open(filename, 'w') as filehandle:
+        csvexport.write_csv(filehandle, [DataTime] + Waveforms)
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_POINTS
+    directory = tempfile.mkdtemp()
+    print("%10s %12s %12s %9s %10s" % ("points", "savetxt (s)", "write_csv (s)", "speedup", "size (MB)"))
+    for points in sizes:
+        capture = make_capture(points)
+        times = []
+        for save in (save_old, save_new):
+            filename = os.path.join(directory, save.__name__ + ".csv")
+            started = time.perf_counter()
+            save(filename, *capture)
+            times.append(time.perf_counter() - started)
+        old_file = os.path.join(directory, "save_old.csv")
+        assert filecmp.cmp(old_file, os.path.join(directory, "save_new.csv"), shallow=False)
+        print("%10d %12.3f %12.3f %9.1f %10.1f" % (points, times[0], times[1], times[0] / times[1],
+                                                   os.path.getsize(old_file) / 1e6))
+    for name in ("save_old.csv", "save_new.csv"):
+        os.remove(os.path.join(directory, name))
+    os.rmdir(directory)
@@ -0,0 +1,264 @@
+# *********************************************************
+# Benchmark suite for the acquisition/transfer/save path,
+# run against simscope so the numbers are reproducible on
+# any machine without an instrument:
+#   query     - query round trip (SCPI parsing, session lock)
+#   transfer  - :WAVeform:DATA? read into a preallocated
+#               buffer and scaled to volts, BYTE and WORD
+#   save      - the grab script's CSV and .npy saves, and
+#               reading the files back
+#   screenshot - :DISPlay:DATA? PNG read and block decode
+# The results are written as JSON.  With --compare, medians
+# are checked against an earlier results file and the exit
+# status is 1 if any got slower by more than --tolerance and
+# its timed runs by more than --min-delta seconds.
+#
+# Usage: python benchmark_suite.py [-o results.json]
+#            [--compare baseline.json] [--help for the rest]
+# *********************************************************
+# Import modules.
+# ---------------------------------------------------------
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import numpy as np
+import csvexport
+import screenshotsave
+import simscope
+import waveform
+
+# Global variables.
+# ---------------------------------------------------------
+GROUPS = ["query", "transfer", "save", "screenshot"]
+TRANSFER_POINTS = [1000, 10000, 100000, 1000000, 8000000]
+SAVE_POINTS = [1000, 100000, 1000000]  # CSV at 8M points takes minutes
+FORMATS = ["BYTE", "WORD"]
+CHANNELS = 4  # Channels in the saved files
+QUERIES_PER_RUN = 1000  # Queries are too short to time one at a time
+DEFAULT_REPEATS = 5
+DEFAULT_TOLERANCE = 0.25
+DEFAULT_MIN_DELTA = 0.001  # Smaller slowdowns of a timed run are timer and scheduler noise
+
+
+# =========================================================
+# Time repeats calls of function, after one untimed call:
+# =========================================================
+def timings(function, repeats, calls=1):
+    # The untimed call builds the simulated blocks and warms up caches.
+    # function does calls operations per call; times are per operation.
+    function()
+    times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - started) / calls)
+    return {"min": min(times), "median": float(np.median(times)), "mean": float(np.mean(times)),
+            "max": max(times), "repeats": repeats, "calls": calls}
+
+
+def result(group, name, params, seconds, nbytes=None):
+    entry = {"group": group, "name": name, "params": params, "seconds": seconds}
+    if nbytes is not None:
+        entry["bytes"] = nbytes
+        entry["mb_per_s"] = nbytes / seconds["median"] / 1e6
+    return entry
+
+
+# =========================================================
+# Query round trips:
+# =========================================================
+def bench_query(options):
+    scope = simscope.SimulatedScope(points=1000, latency=options.latency)
+    cache = waveform.ChannelStateCache(scope)
+    cache.states()
+    params = {"latency": options.latency}
+    for (name, query) in [("idn", lambda: scope.query("*IDN?")),
+                          ("preamble", lambda: scope.query(":WAVeform:PREamble?")),
+                          ("channel_states_cached", cache.states)]:
+        def run():
+            for _ in range(QUERIES_PER_RUN):
+                query()
+        yield result("query", name, params, timings(run, options.repeats, QUERIES_PER_RUN))
+
+
+# =========================================================
+# Waveform transfer and scaling, one channel:
+# =========================================================
+def bench_transfer(options):
+    for fmt in options.formats:
+        for points in options.transfer_points:
+            scope = simscope.SimulatedScope(points=points, channels=1, latency=options.latency,
+                                            bandwidth=options.bandwidth)
+            waveform.configure_format(scope, fmt)
+            preamble = scope.query(":WAVeform:SOURce CHANnel1;PREamble?")
+            codes = waveform.allocate_waveform_buffer(points, 1, fmt)[0]
+            volts = np.empty(points)
+
+            def run():
+                waveform.fetch_waveform_into(scope, "CHANnel1", codes, waveform.DEFAULT_CHUNK_SIZE)
+                waveform.Waveform.from_preamble(codes, preamble).scaled(out=volts)
+            params = {"format": fmt, "points": points, "latency": options.latency,
+                      "bandwidth": options.bandwidth, "chunk_size": waveform.DEFAULT_CHUNK_SIZE}
+            yield result("transfer", "fetch_and_scale", params, timings(run, options.repeats), codes.nbytes)
+
+
+# =========================================================
+# CSV and .npy save and load, as in the grab script:
+# =========================================================
+def make_capture(points):
+    scope = simscope.SimulatedScope(points=points, channels=CHANNELS)
+    preamble = scope._preamble()
+    DataTime = waveform.TimeAxis.from_preamble(preamble)
+    Waveforms = [waveform.Waveform.from_preamble(scope.waveform_codes(channel, "WORD"), preamble)
+                 for channel in range(1, CHANNELS + 1)]
+    Wav_Data = np.zeros([points, CHANNELS])
+    for (i, wave) in enumerate(Waveforms):
+        wave.scaled(out=Wav_Data[:, i])
+    return DataTime, Waveforms, Wav_Data
+
+
+def bench_save(options):
+    directory = tempfile.mkdtemp()
+    csv_file = os.path.join(directory, "capture.csv")
+    npy_file = os.path.join(directory, "capture.npy")
+    try:
+        for points in options.save_points:
+            (DataTime, Waveforms, Wav_Data) = make_capture(points)
+
+            def save_csv():
+                with open(csv_file, 'w') as filehandle:
+                    csvexport.write_csv(filehandle, [DataTime] + Waveforms, delimiter=',')
+
+            def save_npy():
+                with open(npy_file, 'wb') as filehandle:
+                    np.save(filehandle, np.insert(Wav_Data, 0, DataTime.to_array(), axis=1))
+
+            params = {"points": points, "channels": CHANNELS}
+            for (name, function, filename) in [("csv_save", save_csv, csv_file),
+                                               ("csv_load", lambda: np.loadtxt(csv_file, delimiter=','), csv_file),
+                                               ("npy_save", save_npy, npy_file),
+                                               ("npy_load", lambda: np.load(npy_file), npy_file)]:
+                seconds = timings(function, options.repeats)
+                yield result("save", name, params, seconds, os.path.getsize(filename))
+    finally:
+        for filename in (csv_file, npy_file):
+            if os.path.exists(filename):
+                os.remove(filename)
+        os.rmdir(directory)
+
+
+# =========================================================
+# Screen image read:
+# =========================================================
+def bench_screenshot(options):
+    scope = simscope.SimulatedScope(latency=options.latency, bandwidth=options.bandwidth,
+                                    screen_bytes=options.screen_bytes)
+    generation = "X_Series"
+    screenshotsave.prepare_screenshot(scope)
+
+    def run():
+        return screenshotsave.decode_ieee_block(screenshotsave.read_screen_image(scope, generation))
+    params = {"screen_bytes": options.screen_bytes, "latency": options.latency,
+              "bandwidth": options.bandwidth}
+    yield result("screenshot", "read_screen_image", params, timings(run, options.repeats),
+                 options.screen_bytes)
+
+
+BENCHMARKS = {"query": bench_query, "transfer": bench_transfer, "save": bench_save,
+              "screenshot": bench_screenshot}
+
+
+# =========================================================
+# Medians that got slower than in a baseline results file:
+# =========================================================
+def _key(entry):
+    return entry["group"], entry["name"], json.dumps(entry["params"], sort_keys=True)
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE, min_delta=DEFAULT_MIN_DELTA):
+    # Returns (entry, baseline median, ratio) for each benchmark whose
+    # median is more than tolerance (a fraction) above the baseline's,
+    # and whose timed runs (calls operations each) are also more than
+    # min_delta seconds slower, so microsecond jitter of very short
+    # benchmarks is not reported.  Benchmarks missing from either file
+    # are not compared.
+    before = dict((_key(entry), entry["seconds"]["median"]) for entry in baseline["results"])
+    regressions = []
+    for entry in results["results"]:
+        median = before.get(_key(entry))
+        after = entry["seconds"]["median"]
+        calls = entry["seconds"].get("calls", 1)
+        if median and after > median * (1.0 + tolerance) and (after - median) * calls > min_delta:
+            regressions.append((entry, median, after / median))
+    return regressions
+
+
+# =========================================================
+# Run the chosen groups:
+# =========================================================
+def run(options, log=sys.stderr):
+    results = {
+        "meta": {"started": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                 "python": platform.python_version(), "numpy": np.__version__,
+                 "platform": platform.platform(), "machine": platform.machine(),
+                 "processor": platform.processor(),
+                 "settings": {"repeats": options.repeats, "latency": options.latency,
+                              "bandwidth": options.bandwidth}},
+        "results": []}
+    for group in options.groups:
+        for entry in BENCHMARKS[group](options):
+            results["results"].append(entry)
+            log.write("%-10s %-22s %-60s %10.6f s\n" % (entry["group"], entry["name"],
+                                                       json.dumps(entry["params"], sort_keys=True),
+                                                       entry["seconds"]["median"]))
+    return results
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the acquisition/transfer/save path "
+                                                 "against a simulated scope.")
+    parser.add_argument("-o", "--output", help="JSON results file (default: standard output)")
+    parser.add_argument("--groups", nargs="+", choices=GROUPS, default=GROUPS)
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS)
+    parser.add_argument("--transfer-points", type=int, nargs="+", default=TRANSFER_POINTS)
+    parser.add_argument("--save-points", type=int, nargs="+", default=SAVE_POINTS)
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=FORMATS)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds added to every simulated write/query")
+    parser.add_argument("--bandwidth", type=float, default=None,
+                        help="simulated link speed in bytes per second (default: no limit)")
+    parser.add_argument("--screen-bytes", type=int, default=65536)
+    parser.add_argument("--compare", metavar="BASELINE", help="earlier JSON results file to check against")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed slowdown of a median, as a fraction (default: %(default)s)")
+    parser.add_argument("--min-delta", type=float, default=DEFAULT_MIN_DELTA,
+                        help="slowdowns of a timed run below this many seconds are ignored "
+                             "(default: %(default)s)")
+    return parser.parse_args(argv)
+
+
+# =========================================================
+# Main program
+# =========================================================
+if __name__ == '__main__':
+    options = parse_arguments()
+    results = run(options)
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+
+    if options.compare:
+        with open(options.compare) as f:
+            regressions = compare(results, json.load(f), options.tolerance, options.min_delta)
+        for (entry, median, ratio) in regressions:
+            sys.stderr.write("REGRESSION %s %s %s: %.6f s -> %.6f s (x%.2f)\n"
+                             % (entry["group"], entry["name"], json.dumps(entry["params"], sort_keys=True),
+                                median, entry["seconds"]["median"], ratio))
+        sys.exit(1 if regressions else 0)
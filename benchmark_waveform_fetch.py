@@ -0,0 +1,67 @@
+# *********************************************************
+# Compares the grab script's old waveform transfer path,
+# query_binary_values() into a list -> np.array -> column copy,
+# with waveform.fetch_waveform_into() reading straight into a
+# preallocated int16 buffer.  Runs against simscope, so the
+# numbers show the controller-side cost only.
+#
+# Usage: python benchmark_waveform_fetch.py [points ...]
+# *********************************************************
+# Import modules.
+# ---------------------------------------------------------
+import sys
+import time
+import tracemalloc
+import numpy as np
+import simscope
+import waveform
+
+DEFAULT_POINTS = [1000, 100000, 1000000, 8000000]
+
+
+# =========================================================
+# Old path, as in the waveform grab script:
+# =========================================================
+def fetch_old(scope, points):
+    Wav_Data = np.zeros([points, 1])
+    Wav_Data[:, 0] = np.array(scope.query_binary_values(':WAVeform:SOURce CHANnel1;DATA?', "h", False))
+    return Wav_Data
+
+
+# =========================================================
+# New path, reading into a preallocated buffer:
+# =========================================================
+def fetch_new(scope, points):
+    Raw_Data = waveform.allocate_waveform_buffer(points, 1, "WORD")
+    waveform.fetch_waveform_into(scope, "CHANnel1", Raw_Data[0])
+    return Raw_Data
+
+
+# =========================================================
+# Time one call, then repeat it to record its peak memory:
+# =========================================================
+def measure(function, scope, points):
+    # tracemalloc slows down allocation heavy code a lot, so the
+    # timed run and the traced run are kept apart.
+    started = time.perf_counter()
+    result = function(scope, points)
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    function(scope, points)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_POINTS
+    print("%10s %12s %12s %14s %14s" % ("points", "old (s)", "new (s)", "old peak (MB)", "new peak (MB)"))
+    for points in sizes:
+        scope = simscope.SimulatedScope(points=points, channels=1)
+        scope.write(":WAVeform:SOURce CHANnel1;DATA?")  # Build the simulated block up front.
+        scope.clear()
+        (old, old_time, old_peak) = measure(fetch_old, scope, points)
+        (new, new_time, new_peak) = measure(fetch_new, scope, points)
+        assert np.array_equal(old[:, 0], new[0])
+        print("%10d %12.4f %12.4f %14.1f %14.1f" % (points, old_time, new_time,
+                                                     old_peak / 1e6, new_peak / 1e6))
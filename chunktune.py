@@ -0,0 +1,122 @@
+# *********************************************************
+# Per-resource VISA read sizes for bulk transfers (waveform
+# data, screenshots).  The best chunk size depends on the
+# transport (USB, LAN VXI-11/HiSLIP/socket, GPIB) and on the
+# instrument, so it is measured once per VISA address with
+# tune() and kept in a JSON file for later sessions.
+#
+# Usage: python chunktune.py [ADDRESS] [SOURCE]
+# *********************************************************
+# Import modules.
+# ---------------------------------------------------------
+import json
+import os
+import threading
+import time
+
+# Global variables.
+# ---------------------------------------------------------
+CHUNK_SIZE_FILE = os.path.join(os.path.expanduser("~"), ".scope_chunk_sizes.json")
+DEFAULT_CHUNK_SIZE = 20480  # PyVisa's default chunk size
+CANDIDATE_CHUNK_SIZES = [20480, 65536, 262144, 1048576, 4194304, 16777216]
+
+_lock = threading.Lock()
+_chunk_sizes = None  # VISA address -> entry, loaded from CHUNK_SIZE_FILE
+
+
+# =========================================================
+# Transport of a VISA resource string:
+# =========================================================
+def transport_of(address):
+    # e.g. USB0::0x0957::0x179B::MY51452776::0::INSTR -> "USB",
+    # TCPIP0::192.168.1.10::hislip0::INSTR -> "HISLIP",
+    # TCPIP0::192.168.1.10::5025::SOCKET -> "SOCKET",
+    # TCPIP0::192.168.1.10::inst0::INSTR -> "VXI11"
+    parts = address.upper().split("::")
+    if parts[0].startswith("TCPIP"):
+        if parts[-1] == "SOCKET":
+            return "SOCKET"
+        if len(parts) > 2 and parts[2].startswith("HISLIP"):
+            return "HISLIP"
+        return "VXI11"
+    for transport in ("USB", "GPIB", "ASRL"):
+        if parts[0].startswith(transport):
+            return transport
+    return parts[0]
+
+
+# =========================================================
+# Stored chunk sizes, loaded on first use:
+# =========================================================
+def load_chunk_sizes(filename=None):
+    global _chunk_sizes
+    with _lock:
+        if _chunk_sizes is None or filename is not None:
+            try:
+                with open(filename or CHUNK_SIZE_FILE) as f:
+                    _chunk_sizes = json.load(f)
+            except (IOError, ValueError):
+                _chunk_sizes = {}
+        return _chunk_sizes
+
+
+def save_chunk_size(address, chunk_size, throughput=None, filename=None):
+    chunk_sizes = load_chunk_sizes()
+    with _lock:
+        chunk_sizes[address] = {"transport": transport_of(address), "chunk_size": int(chunk_size),
+                                "throughput": throughput, "tuned": time.time()}
+        with open(filename or CHUNK_SIZE_FILE, "w") as f:
+            json.dump(chunk_sizes, f, indent=2, sort_keys=True)
+
+
+# =========================================================
+# Read size to use for bulk transfers from session:
+# =========================================================
+def chunk_size_for(session, default=DEFAULT_CHUNK_SIZE):
+    # The tuned size for the session's address, or default if it has
+    # never been tuned.
+    entry = load_chunk_sizes().get(getattr(session, "address", None))
+    return entry["chunk_size"] if entry else default
+
+
+# =========================================================
+# Measure throughput for each candidate chunk size:
+# =========================================================
+def tune(session, transfer, candidates=CANDIDATE_CHUNK_SIZES, repeats=3, save=True):
+    # transfer(chunk_size) does one bulk transfer with that read size and
+    # returns the number of bytes moved.  Each candidate keeps its best
+    # of repeats runs; candidates far beyond the transfer size behave
+    # like the whole transfer in one read, so they are skipped.  Returns
+    # the best chunk size and {chunk_size: bytes per second}.
+    results = {}
+    transfer_size = None
+    for chunk_size in sorted(candidates):
+        if transfer_size is not None and chunk_size >= 2 * transfer_size:
+            break
+        best = None
+        for _ in range(repeats):
+            started = time.perf_counter()
+            transfer_size = transfer(chunk_size)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        results[chunk_size] = transfer_size / best if best > 0 else float("inf")
+    chunk_size = max(results, key=results.get)
+    if save:
+        save_chunk_size(session.address, chunk_size, results[chunk_size])
+    return chunk_size, results
+
+
+# =========================================================
+# Main program: tune on a channel's waveform data
+# =========================================================
+if __name__ == '__main__':
+    import sys
+    import scopesession
+    import waveform
+    address = sys.argv[1] if len(sys.argv) > 1 else scopesession.DEFAULT_VISA_ADDRESS
+    source = sys.argv[2] if len(sys.argv) > 2 else "CHANnel1"
+    session = scopesession.open_session(address)
+    (chunk_size, results) = waveform.tune_chunk_size(session, source)
+    for size in sorted(results):
+        print("%10d bytes: %8.2f MB/s" % (size, results[size] / 1e6))
+    print("%s (%s): chunk size %d saved to %s" % (address, transport_of(address), chunk_size, CHUNK_SIZE_FILE))
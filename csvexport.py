@@ -0,0 +1,106 @@
+# *********************************************************
+# Streaming CSV export of waveforms.  Rows are formatted a
+# block at a time with one string operation per block, and
+# columns are sliced block by block, so the full table (e.g.
+# np.insert(Wav_Data, 0, DataTime, axis=1)) is never built.
+# waveform.Waveform columns are formatted through a table of
+# the codes they use, so each value is formatted only once.
+# *********************************************************
+# Import modules.
+# ---------------------------------------------------------
+import numpy as np
+import waveform
+
+# Global variables.
+# ---------------------------------------------------------
+DEFAULT_FMT = "%.18e"  # np.savetxt's default, so the output matches it
+DEFAULT_CHUNK_ROWS = 10000
+TABLE_MIN_ROWS = 4096
+
+
+# =========================================================
+# Table of formatted values for the codes a waveform uses:
+# =========================================================
+def _code_table(wave, fmt):
+    # Only codes that occur are formatted, so the table never costs more
+    # formatting than the column itself.  Scaled exactly as
+    # Waveform.scaled() does, so the text is the same as formatting the
+    # scaled array.
+    info = np.iinfo(wave.codes.dtype)
+    used = np.flatnonzero(np.bincount(wave.codes.astype(np.intp) - info.min,
+                                      minlength=info.max - info.min + 1))
+    codes = (used + info.min).astype(wave.codes.dtype)
+    values = waveform.Waveform(codes, wave.y_increment, wave.y_origin, wave.y_reference).scaled()
+    table = np.empty(info.max - info.min + 1, dtype=object)
+    table[used] = ((fmt + "\n") * len(values) % tuple(values.tolist())).split("\n")[:-1]
+    return table, info.min
+
+
+# =========================================================
+# Formatter for one column, returning an object array per block:
+# =========================================================
+class _Column(object):
+    def __init__(self, column, fmt):
+        self.column = column
+        self.fmt = fmt
+        self.table = None
+        # Setting up the table costs about as much as formatting a few
+        # thousand values, so short columns are formatted directly.
+        if (isinstance(column, waveform.Waveform) and column.codes.dtype.kind in "iu"
+                and len(column) > TABLE_MIN_ROWS):
+            (self.table, self.table_start) = _code_table(column, fmt)
+
+    @property
+    def row_fmt(self):
+        return self.fmt if self.table is None else "%s"
+
+    def block(self, start, stop):
+        if self.table is None:
+            return np.asarray(self.column[start:stop])
+        index = self.column.codes[start:stop].astype(np.intp)
+        index -= self.table_start
+        return self.table[index]
+
+
+# =========================================================
+# Write columns to a CSV file, one block of rows at a time:
+# =========================================================
+def write_csv(fname, columns, header=None, fmt=DEFAULT_FMT, delimiter=",",
+              chunk_rows=DEFAULT_CHUNK_ROWS):
+    # fname is a file name or an open text file.  columns is a list of
+    # equal length columns: 1-D arrays, waveform.Waveform objects, or
+    # anything else that slices into a 1-D array; a 2-D array adds each
+    # of its columns.  fmt is one format for all columns or one per
+    # column.  header is written as is, before the data.
+    expanded = []
+    for column in columns:
+        if isinstance(column, np.ndarray) and column.ndim == 2:
+            expanded.extend(column[:, i] for i in range(column.shape[1]))
+        else:
+            expanded.append(column)
+    fmts = [fmt] * len(expanded) if isinstance(fmt, str) else list(fmt)
+    if len(fmts) != len(expanded):
+        raise ValueError("%d formats for %d columns" % (len(fmts), len(expanded)))
+    formatters = [_Column(column, column_fmt) for (column, column_fmt) in zip(expanded, fmts)]
+    rows = len(expanded[0])
+    if any(len(column) != rows for column in expanded):
+        raise ValueError("All columns must have the same length")
+    row_fmt = delimiter.join(formatter.row_fmt for formatter in formatters) + "\n"
+
+    if isinstance(fname, str):
+        with open(fname, "w") as f:
+            return _write_rows(f, formatters, rows, row_fmt, header, chunk_rows)
+    return _write_rows(fname, formatters, rows, row_fmt, header, chunk_rows)
+
+
+def _write_rows(f, formatters, rows, row_fmt, header, chunk_rows):
+    if header:
+        f.write(header)
+    block = np.empty((min(rows, chunk_rows), len(formatters)), dtype=object)
+    for start in range(0, rows, chunk_rows):
+        stop = min(rows, start + chunk_rows)
+        count = stop - start
+        for (j, formatter) in enumerate(formatters):
+            block[:count, j] = formatter.block(start, stop)
+        f.write(row_fmt * count % tuple(block[:count].ravel().tolist()))
+    return rows
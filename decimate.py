@@ -0,0 +1,136 @@
+# *********************************************************
+# Decimation of long captures for display.  A plot is at
+# most a few thousand pixels wide, so records of millions of
+# points are reduced to one min/max pair per pixel column
+# (which, unlike striding, keeps every glitch visible) or to
+# LTTB points (Largest-Triangle-Three-Buckets, for a line
+# that keeps the shape).  The work is a handful of NumPy
+# passes, or one loop over the buckets for LTTB; either way
+# every channel of a (channels, points) array is done at once.
+# *********************************************************
+# Import modules.
+# ---------------------------------------------------------
+import numpy as np
+import waveform
+
+
+# =========================================================
+# Raw values of y, plus a function scaling the decimated result:
+# =========================================================
+def _values(y):
+    # A waveform.Waveform is decimated on its raw codes; only the few
+    # values kept are scaled.
+    if isinstance(y, waveform.Waveform):
+        return y.codes, lambda codes: codes * y.y_increment + y.offset
+    return np.asarray(y), lambda values: values
+
+
+# =========================================================
+# First index of each bucket along the last axis:
+# =========================================================
+def bucket_edges(points, buckets, peak=False):
+    # PEAK data comes as Low,High pairs per time point; the edges then
+    # fall on even indices so a pair is never split between buckets.
+    if peak:
+        return 2 * bucket_edges(points // 2, buckets)
+    return (np.arange(buckets, dtype=np.int64) * points) // buckets
+
+
+# =========================================================
+# Min-max envelope, one min and one max per bucket:
+# =========================================================
+def minmax_envelope(y, buckets, peak=False):
+    # y is an array of shape (..., points), raw codes or scaled values,
+    # or a waveform.Waveform.  Returns (mins, maxs), each (..., buckets),
+    # or y itself twice if it has no more points than buckets.
+    (values, scale) = _values(y)
+    points = values.shape[-1]
+    if points <= buckets * (2 if peak else 1):
+        return scale(values), scale(values)
+    edges = bucket_edges(points, buckets, peak)
+    mins = np.minimum.reduceat(values, edges, axis=-1)
+    maxs = np.maximum.reduceat(values, edges, axis=-1)
+    return scale(mins), scale(maxs)
+
+
+# =========================================================
+# Largest-Triangle-Three-Buckets:
+# =========================================================
+def lttb_indices(y, threshold):
+    # Indices of the threshold points LTTB keeps, shape (..., threshold),
+    # for every row of y at once.  Points are taken as evenly spaced
+    # (as scope samples are), so the indices can be used with any
+    # time axis, e.g. waveform.TimeAxis; PEAK Low,High pairs work too,
+    # as the TimeAxis maps both values of a pair to the same time.
+    # Raw codes are not converted as a whole; each bucket is worked
+    # on in float64 as it comes.
+    (values, _) = _values(y)
+    lead = values.shape[:-1]
+    values = values.reshape(-1, values.shape[-1])
+    points = values.shape[-1]
+    if threshold >= points or threshold < 3:
+        return np.broadcast_to(np.arange(points), lead + (points,)).copy()
+
+    rows = np.arange(values.shape[0])
+    # The first and last points are always kept; the others are split
+    # into threshold - 2 buckets.
+    edges = 1 + (np.arange(threshold - 1, dtype=np.int64) * (points - 2)) // (threshold - 2)
+    selected = np.empty((values.shape[0], threshold), dtype=np.int64)
+    selected[:, 0] = 0
+    selected[:, -1] = points - 1
+    previous = np.zeros(values.shape[0], dtype=np.int64)
+    for bucket in range(threshold - 2):
+        (start, stop) = (edges[bucket], edges[bucket + 1])
+        # Third corner: the average of the next bucket (or the last point).
+        if bucket + 2 < len(edges):
+            next_x = (edges[bucket + 1] + edges[bucket + 2] - 1) / 2.0
+            next_y = values[:, edges[bucket + 1]:edges[bucket + 2]].mean(axis=1)
+        else:
+            next_x = points - 1.0
+            next_y = values[:, -1]
+        previous_y = values[rows, previous].astype(np.float64)
+        x = np.arange(start, stop)
+        # Twice the triangle area, without the constant factor.
+        area = np.abs((previous[:, None] - next_x) * (values[:, start:stop] - previous_y[:, None])
+                      - (previous[:, None] - x) * (next_y - previous_y)[:, None])
+        previous = start + np.argmax(area, axis=1)
+        selected[:, bucket + 1] = previous
+    return selected.reshape(lead + (threshold,))
+
+
+def lttb(y, threshold):
+    # (indices, values) of the points LTTB keeps; values are scaled if y
+    # is a waveform.Waveform.
+    (values, scale) = _values(y)
+    indices = lttb_indices(values, threshold)
+    return indices, scale(np.take_along_axis(values, indices, axis=-1))
+
+
+# =========================================================
+# Display-ready arrays for a plot width pixels wide:
+# =========================================================
+def for_display(y, width, time_axis=None, method="minmax", peak=False):
+    # Returns (x, y) to plot, each (..., n), with n about 2 * width for
+    # "minmax" (a min and a max per pixel column, drawn as a vertical
+    # stroke) or width for "lttb".  x is in seconds if time_axis (a
+    # waveform.TimeAxis, or an array of times) is given, else in samples.
+    # Records that already fit are returned as they are.
+    (values, scale) = _values(y)
+    points = values.shape[-1]
+    if time_axis is None:
+        time_axis = waveform.TimeAxis(points, 1.0, 0.0)
+    if points <= 2 * width:
+        return np.asarray(time_axis[0:points]), scale(values)
+
+    if method == "lttb":
+        (indices, decimated) = lttb(y, width)
+        return np.asarray(time_axis[indices.reshape(-1)]).reshape(indices.shape), decimated
+
+    (mins, maxs) = minmax_envelope(y, width, peak)
+    edges = bucket_edges(points, width, peak)
+    # Each pixel column is drawn at the time of its first sample.
+    x = np.repeat(np.asarray(time_axis[edges]), 2)
+    decimated = np.empty(mins.shape[:-1] + (2 * width,), dtype=np.result_type(mins, maxs))
+    decimated[..., 0::2] = mins
+    decimated[..., 1::2] = maxs
+    return np.broadcast_to(x, decimated.shape), decimated
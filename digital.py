@@ -0,0 +1,102 @@
+# *********************************************************
+# Digital channel (D0-D15) data from the mixed signal (MSO)
+# InfiniiVision scopes.  POD1 (D0-D7) and POD2 (D8-D15) are
+# read in BYTE format and kept bit-packed, two bytes per
+# point, instead of one array element per channel and point.
+# *********************************************************
+# Import modules.
+# ---------------------------------------------------------
+import numpy as np
+import chunktune
+import waveform
+
+# Global variables.
+# ---------------------------------------------------------
+BITS_PER_POD = 8
+PODS = (1, 2)
+
+
+# =========================================================
+# Bit-packed digital capture:
+# =========================================================
+class DigitalCapture(object):
+    # packed has shape (points, 2), uint8: column 0 is POD1 with D0 in
+    # bit 0, column 1 is POD2 with D8 in bit 0.  Read as little endian
+    # uint16 (words), bit n of each point is channel Dn.
+    def __init__(self, packed, time_axis=None):
+        self.packed = np.ascontiguousarray(packed, dtype=np.uint8)
+        self.time_axis = time_axis
+        self._changes = None
+
+    def __len__(self):
+        return len(self.packed)
+
+    @property
+    def nbytes(self):
+        return self.packed.nbytes
+
+    # All 16 channels of each point as one uint16, without copying.
+    @property
+    def words(self):
+        return self.packed.view("<u2").reshape(-1)
+
+    # Channel Dn as 0/1 values, one uint8 per point.
+    def bit(self, channel):
+        return (self.packed[:, channel // BITS_PER_POD] >> (channel % BITS_PER_POD)) & 1
+
+    def __getitem__(self, channel):
+        return self.bit(channel)
+
+    # Channels (all 16 if None) unpacked to 0/1, shape (channels, points).
+    def unpack(self, channels=None):
+        bits = np.unpackbits(self.packed, axis=1, bitorder="little").T
+        return bits if channels is None else bits[list(channels)]
+
+    # Bits that changed between each point and the next, for all
+    # channels at once; computed on first use and kept.
+    @property
+    def changes(self):
+        if self._changes is None:
+            words = self.words
+            self._changes = words[1:] ^ words[:-1]
+        return self._changes
+
+    # Indices of the points where channel Dn changes; edge is "both",
+    # "rising" or "falling".  Index i means point i differs from i - 1.
+    def edges(self, channel, edge="both"):
+        index = np.flatnonzero((self.changes >> channel) & 1) + 1
+        if edge == "both":
+            return index
+        level = self.bit(channel)[index]
+        return index[level == (1 if edge == "rising" else 0)]
+
+    # Times of the edges, if the capture has a time axis.
+    def edge_times(self, channel, edge="both"):
+        return self.time_axis[self.edges(channel, edge)]
+
+
+# =========================================================
+# Which pods are displayed:
+# =========================================================
+def pods_on(session):
+    reply = session.query(";".join(":POD%d:DISPlay?" % pod for pod in PODS))
+    return [pod for (pod, on) in zip(PODS, reply.strip().split(";")) if int(on) == 1]
+
+
+# =========================================================
+# Download POD1 and/or POD2 into one bit-packed capture:
+# =========================================================
+def fetch_pods(session, pods=PODS, chunk_size=None):
+    # Leaves :WAVeform:FORMat set to BYTE.  A pod not in pods reads as 0.
+    if chunk_size is None:
+        chunk_size = chunktune.chunk_size_for(session, waveform.DEFAULT_CHUNK_SIZE)
+    with session.lock:
+        waveform.configure_format(session, "BYTE")
+        preamble = session.query(":WAVeform:SOURce POD%d;PREamble?" % pods[0])
+        time_axis = waveform.TimeAxis.from_preamble(preamble)
+        # Each pod is read into its own contiguous row, then the rows are
+        # interleaved once into the (points, 2) layout.
+        rows = np.zeros((len(PODS), len(time_axis)), dtype=np.uint8)
+        for pod in pods:
+            waveform.fetch_waveform_into(session, "POD%d" % pod, rows[pod - 1], chunk_size)
+    return DigitalCapture(rows.T, time_axis)
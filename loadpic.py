@@ -1,48 +1,57 @@
+import time
+start_time = time.perf_counter()  # Used to report the time to first window.
+
 import sys
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
-import visa
-import string
-import struct
-import requests
 import screenshotsave
-from measurev import do_command, do_query_string,do_query_number
+import scopeworkers
+from measurev import do_query_string,do_query_number,do_query_measurements
 
 debug = 0
 
-rm = visa.ResourceManager('C:\\Windows\\System32\\visa32.dll')
-InfiniiVision = rm.open_resource("USB0::0x0957::0x179B::MY51452776::0::INSTR")
-InfiniiVision.timeout = 15000
-InfiniiVision.clear()
+SCREENSHOT_FILE = "D:\\DATA\\Scope_Image.png"
+MEASUREMENTS = ["VMAX", "VMIN", "VPP", "VAVerage", "FREQuency", "PERiod"]
+POLL_INTERVAL_MS = 500  # 测量数据刷新周期
+SCREENSHOT_MAX_FPS = 2.0  # 截图刷新帧率上限
 
 ############################################################
 #数据测试与读取
 ############################################################
-do_command(":MEASure:VMAX")
-qresult_vmax = do_query_number(":MEASure:VMAX?")
-
-do_command(":MEASure:VMIN")
-qresult_vmin = do_query_number(":MEASure:VMIN?")
-
-do_command(":MEASure:VPP")
-qresult_vpp = do_query_number(":MEASure:VPP?")
-
-do_command(":MEASure:VAVerage")
-qresult_vav = do_query_number(":MEASure:VAVerage?")
-
-do_command(":MEASure:FREQuency")
-qresult_fre = do_query_number(":MEASure:FREQuency?")
-
-do_command(":MEASure:PERiod")
-qresult_per = do_query_number(":MEASure:PERiod?")
+def read_measurements():
+    # 一次总线往返读取全部测量值
+    return do_query_measurements(MEASUREMENTS)
 
 
 class TextEditDemo(QWidget):
-    def __init__(self, parent=None):
+    firstPainted = pyqtSignal()
+
+    # lazy=True shows the window first and reads the scope afterwards;
+    # otherwise pass in results read before the window is created.
+    def __init__(self, parent=None, lazy=True, results=None):
         super(TextEditDemo, self).__init__(parent)
+        self.results = results or {}
+        self._painted = False
         self.initUI()
 
+        # 后台线程定时刷新测量数据，示波器STOP时暂停
+        self.poller = scopeworkers.MeasurementPoller(MEASUREMENTS, POLL_INTERVAL_MS)
+        self.poller.resultReady.connect(self.show_poll_result)
+        self.poller.failed.connect(self.textedit.setPlainText)
+
+        # 截图直接在内存中解码显示，不再写入PNG文件
+        self.streamer = scopeworkers.ScreenshotStreamer(SCREENSHOT_MAX_FPS)
+        self.streamer.resultReady.connect(self.show_frame)
+        self.streamer.failed.connect(self.label1.setText)
+        if lazy:
+            self.firstPainted.connect(self.schedule_load_scope_data)
+        else:
+            self.show_results()
+            self.label1.setPixmap(QPixmap(SCREENSHOT_FILE))
+            self.poller.start()
+            self.streamer.start()
+
     def initUI(self):
         hbox = QHBoxLayout(self)
         self.setWindowTitle('Measure')
@@ -78,13 +87,12 @@ class TextEditDemo(QWidget):
         splitter2_half.addWidget(btnPress2)
         splitter2_half.addWidget(btnPress3)
 
-        label1 = QLabel(self)
-        label1.setPixmap(QPixmap("D:\\DATA\\Scope_Image.png"))
+        self.label1 = QLabel(self)
         splitter2 = QSplitter(Qt.Vertical)
         splitter2.addWidget(splitter1)
 
         splitter2_assemble = QSplitter(Qt.Vertical)
-        splitter2_assemble.addWidget(label1)
+        splitter2_assemble.addWidget(self.label1)
         splitter2_assemble.addWidget(splitter2_half)
         splitter2_assemble.setSizes([300, 100])
         # splitter2.addWidget(bottom)
@@ -100,30 +108,74 @@ class TextEditDemo(QWidget):
         btnPress1_half_2.clicked.connect(self.btnPress1_half_2_clicked)
         btnPress1_half_3.clicked.connect(self.btnPress1_half_3_clicked)
 
+    def paintEvent(self, event):
+        super(TextEditDemo, self).paintEvent(event)
+        if not self._painted:
+            self._painted = True
+            self.firstPainted.emit()
+
+    def schedule_load_scope_data(self):
+        # 窗口画出之后再访问示波器
+        QTimer.singleShot(0, self.load_scope_data)
+
+    def load_scope_data(self):
+        self.poller.start()
+        self.streamer.start()
+
+    def show_frame(self):
+        self.label1.setPixmap(QPixmap.fromImage(self.streamer.take_result()))
+
+    def show_poll_result(self):
+        self.results = self.poller.take_result()
+        self.show_results()
+
+    def closeEvent(self, event):
+        self.poller.stop()
+        self.streamer.stop()
+        super(TextEditDemo, self).closeEvent(event)
+
     def btnPress1_clicked(self):
+        self.show_results()
+        self.poller.request_refresh()
+
+    def show_results(self):
         # 以文本的形式输出到多行文本框
         self.textedit.setPlainText(
-            "VMAX(伏特) : %s\nVMIN(伏特) : %s\nVPP(伏特) : %s\nV average(伏特) : %s\nFrequency(赫兹) : %s\nPeriod(秒) : %s\n" % (
-            qresult_vmax, qresult_vmin, qresult_vpp, qresult_vav, qresult_fre, qresult_per))
+            "VMAX(伏特) : %s\nVMIN(伏特) : %s\nVPP(伏特) : %s\nV average(伏特) : %s\nFrequency(赫兹) : %s\nPeriod(秒) : %s\n" %
+            tuple(self.results.get(name, "--") for name in MEASUREMENTS))
 
+    # 按钮命令交给测量线程发送，截图占用总线时界面不会卡住
     def btnPress2_clicked(self):
-        do_command(":AUToscale")
+        self.poller.send_command(":AUToscale", refresh=True)
         # 控制AUTO键
 
     def btnPress1_half_1_clicked(self):
-        do_command(":SINGle")
+        self.poller.send_command(":SINGle", refresh=True)
 
         # 控制垂直调整旋钮
 
     def btnPress1_half_2_clicked(self):
-        do_command(":STOP")
+        self.poller.send_command(":STOP")
         # 控制水平调整旋钮
 
     def btnPress1_half_3_clicked(self):
-        do_command(":RUN")
+        self.poller.send_command(":RUN")
+
+
+def report_first_window():
+    print("Time to first window: %.1f ms" % ((time.perf_counter() - start_time) * 1000.0))
+
 
 if __name__ == '__main__':
+    # --eager reads the scope before the window is shown (the old start-up)
+    lazy = "--eager" not in sys.argv
     app = QApplication(sys.argv)
-    win = TextEditDemo()
+    if lazy:
+        win = TextEditDemo()
+    else:
+        results = read_measurements()
+        screenshotsave.save_screenshot(SCREENSHOT_FILE)
+        win = TextEditDemo(lazy=False, results=results)
+    win.firstPainted.connect(report_first_window)
     win.show()
-    sys.exit(app.exec_())
\ No newline at end of file
+    sys.exit(app.exec_())
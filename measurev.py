@@ -4,33 +4,272 @@
 # *********************************************************
 # Import modules.
 # ---------------------------------------------------------
-import visa
 import string
 import struct
 import sys
-import requests
+import time
+import threading
+import collections
+import contextlib
+import weakref
+import scopesession
 
 # Global variables (booleans: 0 = False, 1 = True).
 # ---------------------------------------------------------
 debug = 0
+
+VISA_ADDRESS = "USB0::0x0957::0x179B::MY51452776::0::INSTR"
+
+# The shared session, opened on first use by instrument().
+InfiniiVision = None
+
+# Error-check policies, see set_error_check_policy():
+#   command - drain :SYSTem:ERRor? after every command/query.
+#   batch   - drain once when the outermost error_check_batch()
+#             block ends; a call outside a block is a batch of one.
+#   session - only drain when flush_instrument_errors() is called.
+#   esr     - fold a *ESR? status query into each message and only
+#             drain :SYSTem:ERRor? when an error bit is set.
+# ---------------------------------------------------------
+ERROR_CHECK_COMMAND = "command"
+ERROR_CHECK_BATCH = "batch"
+ERROR_CHECK_SESSION = "session"
+ERROR_CHECK_ESR = "esr"
+ERROR_CHECK_POLICIES = (ERROR_CHECK_COMMAND, ERROR_CHECK_BATCH,
+                        ERROR_CHECK_SESSION, ERROR_CHECK_ESR)
+error_check_policy = ERROR_CHECK_COMMAND
+
+# *ESR? bits: query error (4), device dependent error (8),
+# execution error (16) and command error (32).
+ESR_ERROR_MASK = 0x3C
+
+# :OPERegister:CONDition? Run bit, set while acquiring.
+OPER_RUN_BIT = 0x08
+
+# The scope's error queue is never deeper than this.
+ERROR_QUEUE_DEPTH = 32
+
+# Per-thread state: error_check_batch() depth and the instrument
+# bound by using_instrument().
+_thread_state = threading.local()
+
+
+# =========================================================
+# Raised when the instrument reports errors:
+# =========================================================
+class InstrumentError(Exception):
+    def __init__(self, errors, commands):
+        self.errors = list(errors)
+        self.commands = list(commands)
+        Exception.__init__(self, "ERROR: %s, command: '%s'"
+                           % ("; ".join(self.errors), "; ".join(self.commands)))
+
+
+# =========================================================
+# Memoizes :MEASure queries while the capture is frozen:
+# =========================================================
+class MeasurementCache(object):
+    # Every command sent through do_command() starts a new generation,
+    # since any setup change (:MEASure:SOURce, :MEASure:STATistics:RESet,
+    # :CHANnel, :TIMebase, ...) can change the results.  These headers
+    # (short and long forms) also start a new acquisition, and say
+    # whether the capture is frozen afterwards.  :SINGle is only frozen
+    # once acquisition_running() says so.
+    ACQUISITION_COMMANDS = {
+        ":RUN": False,
+        ":AUT": False, ":AUTOSCALE": False,
+        ":SING": False, ":SINGLE": False,
+        ":DIG": True, ":DIGITIZE": True,
+        ":STOP": True,
+    }
+
+    def __init__(self):
+        self.enabled = True
+        self.frozen = False  # Unknown at start-up, so assume running.
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    # Returns (hit, value, generation); pass generation to store().
+    def lookup(self, query):
+        if not query.lstrip().upper().startswith(":MEAS"):
+            return False, None, None
+        with self._lock:
+            if self.enabled and self.frozen:
+                key = (query, self.generation)
+                if key in self._entries:
+                    self.hits += 1
+                    return True, self._entries[key], self.generation
+            self.misses += 1
+            return False, None, self.generation
+
+    def store(self, query, value, generation):
+        with self._lock:
+            # Dropped if an acquisition started while the query was on the bus.
+            if self.enabled and self.frozen and generation == self.generation:
+                self._entries[(query, generation)] = value
+
+    def invalidate(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def note_command(self, command):
+        for part in command.split(";"):
+            header = part.strip().split(" ", 1)[0].upper()
+            if not header or header.endswith("?"):
+                continue
+            if not header.startswith((":", "*")):  # "RUN" is ":RUN".
+                header = ":" + header
+            with self._lock:
+                self.generation += 1
+                self._entries.clear()
+                if header in self.ACQUISITION_COMMANDS:
+                    self.frozen = self.ACQUISITION_COMMANDS[header]
+
+    # Called with what :OPERegister:CONDition? reports.
+    def note_running(self, running):
+        with self._lock:
+            if running and self.frozen:
+                self.generation += 1
+                self._entries.clear()
+            self.frozen = not running
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "generation": self.generation, "entries": len(self._entries),
+                    "frozen": self.frozen}
+
+
+# =========================================================
+# State kept for each instrument session:
+# =========================================================
+class _InstrumentState(object):
+    def __init__(self):
+        self.measurement_cache = MeasurementCache()
+        # Commands sent since the error queue was last drained.
+        self.unchecked_commands = collections.deque(maxlen=ERROR_QUEUE_DEPTH)
+
+
+_instrument_states = weakref.WeakKeyDictionary()
+_instrument_states_lock = threading.Lock()
+
+
+def _state():
+    session = instrument()
+    with _instrument_states_lock:
+        state = _instrument_states.get(session)
+        if state is None:
+            state = _instrument_states[session] = _InstrumentState()
+    return state
+
+
+# =========================================================
+# The measurement cache of the current instrument:
+# =========================================================
+def get_measurement_cache():
+    # Front-panel RUN/STOP is only seen via acquisition_running(); call
+    # get_measurement_cache().invalidate() after changing the scope by hand.
+    return _state().measurement_cache
+
+
+# =========================================================
+# Select when the error queue is checked:
+# =========================================================
+def set_error_check_policy(policy):
+    global error_check_policy
+    if policy not in ERROR_CHECK_POLICIES:
+        raise ValueError("Unknown error-check policy '%s', expected one of %s"
+                         % (policy, ", ".join(ERROR_CHECK_POLICIES)))
+    error_check_policy = policy
+
+
+# =========================================================
+# Connect to the oscilloscope (nothing is opened at import):
+# =========================================================
+def connect(address=VISA_ADDRESS, timeout=15000):
+    # Calling it again for the same address returns the session already
+    # held; a new address releases the old session first, so repeated
+    # calls never hold more than one reference.
+    global InfiniiVision
+    if InfiniiVision is not None:
+        if InfiniiVision.address == address:
+            return InfiniiVision
+        (previous, InfiniiVision) = (InfiniiVision, None)
+        previous.close()
+    InfiniiVision = scopesession.open_session(address, timeout=timeout)
+    return InfiniiVision
+
+
+def instrument():
+    session = getattr(_thread_state, "instrument", None)
+    if session is not None:
+        return session
+    if InfiniiVision is None:
+        connect()
+    return InfiniiVision
+
+
+# =========================================================
+# Run measurev calls in this thread against another session:
+# =========================================================
+@contextlib.contextmanager
+def using_instrument(session):
+    previous = getattr(_thread_state, "instrument", None)
+    _thread_state.instrument = session
+    try:
+        yield session
+    finally:
+        _thread_state.instrument = previous
+
+
+# =========================================================
+# Send a message, folding in *ESR? when the policy wants it:
+# =========================================================
+def _query_with_status(message):
+    if error_check_policy != ERROR_CHECK_ESR:
+        return instrument().query(message), None
+    fields = instrument().query("%s;*ESR?" % message).rsplit(";", 1)
+    if len(fields) == 2:
+        return fields[0], int(fields[1])
+    # A rejected query sends no reply, only the *ESR? field: report
+    # what the error queue holds, or the status alone if it is empty.
+    esr = int(fields[0])
+    _state().unchecked_commands.append(message)
+    flush_instrument_errors()
+    raise InstrumentError(["*ESR? %d (error bits %d), no reply" % (esr, esr & ESR_ERROR_MASK)], [message])
+
+
+def _write_with_status(command):
+    if error_check_policy != ERROR_CHECK_ESR:
+        instrument().write(command)
+        return None
+    return int(instrument().query("%s;*ESR?" % command))
+
+
 # =========================================================
 # Send a command and check for errors:
 # =========================================================
 def do_command(command, hide_params=False):
     if hide_params:
-        (header, data) = string.split(command, " ", 1)
+        (header, data) = command.split(" ", 1)
         if debug:
             print("\nCmd = '%s'" % header)
     else:
         if debug:
             print("\nCmd = '%s'" % command)
 
-    InfiniiVision.write("%s" % command)
+    with instrument().lock:  # Keep other threads out until checked.
+        esr = _write_with_status("%s" % command)
+        get_measurement_cache().note_command(command)
 
-    if hide_params:
-        check_instrument_errors(header)
-    else:
-        check_instrument_errors(command)
+        if hide_params:
+            check_instrument_errors(header, esr)
+        else:
+            check_instrument_errors(command, esr)
 
 # =========================================================
 # Send a command and binary values and check for errors:
@@ -38,8 +277,10 @@ def do_command(command, hide_params=False):
 def do_command_ieee_block(command, values):
     if debug:
         print("Cmb = '%s'" % command)
-    InfiniiVision.write_binary_values("%s " % command, values, datatype='c')
-    check_instrument_errors(command)
+    with instrument().lock:
+        instrument().write_binary_values("%s " % command, values, datatype='c')
+        get_measurement_cache().note_command(command)
+        check_instrument_errors(command)
 
 # =========================================================
 # Send a query, check for errors, return string:
@@ -47,8 +288,13 @@ def do_command_ieee_block(command, values):
 def do_query_string(query):
     if debug:
         print("Qys = '%s'" % query)
-    result = InfiniiVision.query("%s" % query)
-    check_instrument_errors(query)
+    (hit, result, generation) = get_measurement_cache().lookup(query)
+    if hit:
+        return result
+    with instrument().lock:
+        (result, esr) = _query_with_status("%s" % query)
+        check_instrument_errors(query, esr)
+    get_measurement_cache().store(query, result, generation)
     return result
 
 # =========================================================
@@ -57,8 +303,13 @@ def do_query_string(query):
 def do_query_number(query):
     if debug:
         print("Qyn = '%s'" % query)
-    results = InfiniiVision.query("%s" % query)
-    check_instrument_errors(query)
+    (hit, results, generation) = get_measurement_cache().lookup(query)
+    if hit:
+        return float(results)
+    with instrument().lock:
+        (results, esr) = _query_with_status("%s" % query)
+        check_instrument_errors(query, esr)
+    get_measurement_cache().store(query, results, generation)
     return float(results)
 
 # =========================================================
@@ -67,78 +318,199 @@ def do_query_number(query):
 def do_query_ieee_block(query):
     if debug:
         print("Qys = '%s'" % query)
-    result = InfiniiVision.query_binary_values("%s" % query, datatype='s')
-    check_instrument_errors(query)
+    with instrument().lock:
+        result = instrument().query_binary_values("%s" % query, datatype='s')
+        check_instrument_errors(query)
     return result[0]
 
 # =========================================================
-# Check for instrument errors:
+# Check for instrument errors according to the policy:
 # =========================================================
-def check_instrument_errors(command):
-    while True:
-        error_string = InfiniiVision.query(":SYSTem:ERRor?")
-        if error_string:  # If there is an error string value.
-            if error_string.find("+0,", 0, 3) == -1:  # Not "No error".
+def check_instrument_errors(command, esr=None):
+    _state().unchecked_commands.append(command)
+
+    if error_check_policy == ERROR_CHECK_SESSION:
+        return
+    if error_check_policy == ERROR_CHECK_BATCH and getattr(_thread_state, "depth", 0):
+        return
+    if error_check_policy == ERROR_CHECK_ESR:
+        if esr is None:
+            esr = int(instrument().query("*ESR?"))
+        if not esr & ESR_ERROR_MASK:  # Nothing in the error queue.
+            _state().unchecked_commands.clear()
+            return
 
-                print("ERROR: %s, command: '%s'" % (error_string, command))
-                print("Exited because of error.")
-                sys.exit(1)
+    flush_instrument_errors()
 
+# =========================================================
+# Drain the error queue, raise InstrumentError if not empty:
+# =========================================================
+def flush_instrument_errors():
+    commands = list(_state().unchecked_commands)
+    _state().unchecked_commands.clear()
+
+    errors = []
+    for i in range(ERROR_QUEUE_DEPTH):
+        error_string = instrument().query(":SYSTem:ERRor?")
+        if error_string:  # If there is an error string value.
+            if error_string.find("+0,", 0, 3) == -1:  # Not "No error".
+                errors.append(error_string.strip())
             else:  # "No error"
                 break
         else:  # :SYSTem:ERRor? should always return string.
-            print("ERROR: :SYSTem:ERRor? returned nothing, command: '%s'" % command)
-            print("Exited because of error.")
-            sys.exit(1)
+            errors.append(":SYSTem:ERRor? returned nothing")
+            break
 
+    if errors:
+        raise InstrumentError(errors, commands)
 
-#def capture():
+# =========================================================
+# Check for errors once at the end of a block of commands:
+# =========================================================
+@contextlib.contextmanager
+def error_check_batch():
+    _thread_state.depth = getattr(_thread_state, "depth", 0) + 1
+    try:
+        yield
+    finally:
+        _thread_state.depth -= 1
+    if _thread_state.depth == 0 and error_check_policy == ERROR_CHECK_BATCH:
+        flush_instrument_errors()
 
-def analyze():
-    # Make measurements.
-    # --------------------------------------------------------
-    do_command(":MEASure:VMAX")
-    qresult_vmax = do_query_string(":MEASure:VMAX?")
-    #print("VMAX : %s" % qresult_vmax)
 
-    do_command(":MEASure:VMIN")
-    qresult_vmin = do_query_string(":MEASure:VMIN?")
-   # print("VMIN : %s" % qresult_vmin)
+# =========================================================
+# Measurements taken by analyze():
+# =========================================================
+MEASUREMENTS = ["VMAX", "VMIN", "VPP", "VAMPlitude", "VAVerage",
+                "FREQuency", "PERiod"]
 
-    do_command(":MEASure:VPP")
-    qresult_vpp = do_query_string(":MEASure:VPP?")
-    #print("VPP : %s" % qresult_vpp)
+# =========================================================
+# Send a batch of measurements as one message, check for
+# errors once, return a dict of floating-point values:
+# =========================================================
+def do_query_measurements(names, source=None):
+    # Each measurement is installed and queried in the same
+    # semicolon-chained message, e.g.
+    #   :MEASure:VMAX CHANnel1;:MEASure:VMAX? CHANnel1;...
+    # so the whole set costs a single bus transaction.
+    parts = []
+    for name in names:
+        header = ":MEASure:%s" % name
+        if source:
+            parts.append("%s %s" % (header, source))
+            parts.append("%s? %s" % (header, source))
+        else:
+            parts.append(header)
+            parts.append("%s?" % header)
+    query = ";".join(parts)
+    if debug:
+        print("Qym = '%s'" % query)
+    (hit, results, generation) = get_measurement_cache().lookup(query)
+    if not hit:
+        with instrument().lock:
+            (results, esr) = _query_with_status(query)
+            check_instrument_errors(query, esr)
 
-    do_command(":MEASure:VAMPlitude")
-    qresult_vam = do_query_string(":MEASure:VAMPlitude?")
-    #print("V amplitude : %s" % qresult_vam)
+    values = results.strip().split(";")
+    if len(values) != len(names):
+        raise IOError("Expected %d measurement results, got %d: '%s'"
+                      % (len(names), len(values), results.strip()))
+    if not hit:
+        get_measurement_cache().store(query, results, generation)
+    return dict(zip(names, [float(value) for value in values]))
 
-    do_command(":MEASure:VAVerage")
-    qresult_vav = do_query_string(":MEASure:VAVerage?")
-    #print("V average : %s" % qresult_vav)
 
-    do_command(":MEASure:FREQuency")
-    qresult_fre = do_query_string(":MEASure:FREQuency?")
-    #print("Frequency: %s" % qresult_fre)
+# =========================================================
+# Statistics the scope keeps for each active measurement:
+# =========================================================
+MeasurementStatistics = collections.namedtuple(
+    "MeasurementStatistics",
+    ["label", "current", "minimum", "maximum", "mean", "std_dev", "count"])
 
-    do_command(":MEASure:PERiod")
-    qresult_per = do_query_string(":MEASure:PERiod?")
-    #print("Period : %s" % qresult_per)
+# =========================================================
+# Turn on scope-side measurement statistics:
+# =========================================================
+def enable_measurement_statistics(reset=True, max_count=None):
+    # ON makes :MEASure:RESults? report every statistic; std dev is
+    # kept absolute so it is in the measurement's own units.
+    parts = [":MEASure:STATistics ON", ":MEASure:STATistics:RSDeviation OFF"]
+    if max_count is not None:  # Not available on every model.
+        parts.append(":MEASure:STATistics:MCOunt %d" % max_count)
+    if reset:
+        parts.append(":MEASure:STATistics:RESet")
+    do_command(";".join(parts))
 
+# =========================================================
+# Read statistics for all active measurements in one query:
+# =========================================================
+def do_query_statistics():
+    # With statistics ON the reply is, for each measurement:
+    #   label,current,min,max,mean,std dev,count,...
+    results = do_query_string(":MEASure:RESults?")
+    fields = results.strip().split(",")
+    width = len(MeasurementStatistics._fields)
+    if len(fields) % width:
+        raise IOError("Expected %d fields per measurement in :MEASure:RESults?, got '%s'"
+                      % (width, results.strip()))
+
+    statistics = collections.OrderedDict()
+    for i in range(0, len(fields), width):
+        label = fields[i].strip()
+        values = [float(value) for value in fields[i + 1:i + width - 1]]
+        count = int(float(fields[i + width - 1]))
+        statistics[label] = MeasurementStatistics(label, *(values + [count]))
+    return statistics
 
+# =========================================================
+# Poll the statistics until each measurement has min_count:
+# =========================================================
+def wait_for_statistics(min_count, timeout=60.0, poll_interval=0.5):
+    deadline = time.time() + timeout
+    while True:
+        statistics = do_query_statistics()
+        if statistics and min(s.count for s in statistics.values()) >= min_count:
+            return statistics
+        if time.time() >= deadline:
+            raise IOError("Timed out waiting for %d measurement statistics samples"
+                          % min_count)
+        time.sleep(poll_interval)
 
 
 # =========================================================
-# Main program:
+# Is the scope acquiring (RUN/SINGle armed) or STOPped?
 # =========================================================
+def acquisition_running():
+    # :OPERegister:CONDition? bit 3 is the Run bit.
+    running = bool(int(do_query_number(":OPERegister:CONDition?")) & OPER_RUN_BIT)
+    get_measurement_cache().note_running(running)
+    return running
+
+
+#def capture():
+
+def analyze():
+    # Make measurements.
+    # --------------------------------------------------------
+    results = do_query_measurements(MEASUREMENTS)
+    #for name in MEASUREMENTS:
+    #    print("%s : %s" % (name, results[name]))
+    return results
+
 
-rm = visa.ResourceManager()
-InfiniiVision = rm.open_resource("USB0::0x0957::0x179B::MY51452776::0::INSTR")
-InfiniiVision.timeout = 15000
-InfiniiVision.clear()
+# =========================================================
+# Main program:
+# =========================================================
+if __name__ == '__main__':
+    connect()
 
-# Initialize the oscilloscope, capture data, and analyze.
-#initialize()
-#capture()
-analyze()
-print("End of program.")
+    # Initialize the oscilloscope, capture data, and analyze.
+    #initialize()
+    #capture()
+    try:
+        analyze()
+        flush_instrument_errors()  # Catches anything deferred by the policy.
+    except InstrumentError as e:
+        print(e)
+        print("Exited because of error.")
+        sys.exit(1)
+    print("End of program.")
@@ -0,0 +1,93 @@
+# *********************************************************
+# Runs the measurev measurement set on many oscilloscopes at
+# once.  Each scope gets its own shared session and worker
+# thread, so the total time is close to the slowest scope
+# rather than the sum, and a slow or failed scope does not
+# hold up the others.
+# *********************************************************
+# Import modules.
+# ---------------------------------------------------------
+import collections
+import sys
+import time
+from concurrent import futures
+import measurev
+import scopesession
+
+# One row of the result table.  values is None and error is set if
+# the scope failed or did not answer within the overall timeout.
+ScopeResult = collections.namedtuple("ScopeResult", ["address", "values", "latency", "error"])
+
+
+# =========================================================
+# Measure one scope; never raises, errors go in the result:
+# =========================================================
+def _measure_one(address, names, source, io_timeout):
+    started = time.perf_counter()
+    try:
+        session = scopesession.open_session(address, timeout=io_timeout)
+        try:
+            with measurev.using_instrument(session):
+                values = measurev.do_query_measurements(names, source)
+        finally:
+            session.close()
+    except Exception as e:
+        return ScopeResult(address, None, time.perf_counter() - started, e)
+    return ScopeResult(address, values, time.perf_counter() - started, None)
+
+
+# =========================================================
+# Measure every address in parallel on a bounded thread pool:
+# =========================================================
+def measure_all(addresses, names=measurev.MEASUREMENTS, source=None,
+                max_workers=8, timeout=None, io_timeout=scopesession.DEFAULT_TIMEOUT):
+    # timeout (seconds) bounds the whole fan-out; scopes that have not
+    # answered by then are reported as timed out and left to finish
+    # in the background.  io_timeout (ms) is each session's VISA timeout.
+    addresses = list(collections.OrderedDict.fromkeys(addresses))
+    results = collections.OrderedDict((address, None) for address in addresses)
+    if not addresses:
+        return []
+
+    executor = futures.ThreadPoolExecutor(max_workers=min(max_workers, len(addresses)))
+    started = time.perf_counter()
+    pending = dict((executor.submit(_measure_one, address, names, source, io_timeout), address)
+                   for address in addresses)
+    try:
+        for future in futures.as_completed(pending, timeout=timeout):
+            results[pending[future]] = future.result()
+    except futures.TimeoutError:
+        for future, address in pending.items():
+            if results[address] is None:
+                future.cancel()
+                results[address] = ScopeResult(
+                    address, None, time.perf_counter() - started,
+                    futures.TimeoutError("No answer within %.1f s" % timeout))
+    finally:
+        executor.shutdown(wait=False)
+    return list(results.values())
+
+
+# =========================================================
+# Format the results as a text table, one row per scope:
+# =========================================================
+def format_result_table(results, names=measurev.MEASUREMENTS):
+    lines = ["\t".join(["Address", "Latency (s)"] + list(names) + ["Error"])]
+    for result in results:
+        if result.values is None:
+            values = [""] * len(names)
+        else:
+            values = ["%g" % result.values[name] for name in names]
+        lines.append("\t".join([result.address, "%.3f" % result.latency] + values
+                               + [str(result.error or "")]))
+    return "\n".join(lines)
+
+
+# =========================================================
+# Main program: python multiscope.py ADDRESS [ADDRESS ...]
+# =========================================================
+if __name__ == '__main__':
+    started = time.perf_counter()
+    results = measure_all(sys.argv[1:] or [scopesession.DEFAULT_VISA_ADDRESS])
+    print(format_result_table(results))
+    print("Total wall time: %.3f s" % (time.perf_counter() - started))
@@ -0,0 +1,168 @@
+# *********************************************************
+# Shared VISA sessions for the oscilloscope modules.
+# Each VISA address is opened and cleared once; every module
+# that asks for the same address gets the same session back.
+# *********************************************************
+# Import modules.
+# ---------------------------------------------------------
+import atexit
+import threading
+
+# Global variables.
+# ---------------------------------------------------------
+DEFAULT_VISA_ADDRESS = "USB0::0x0957::0x179B::MY51452776::0::INSTR"
+DEFAULT_TIMEOUT = 15000  # IO time out in milliseconds
+
+# Path to visa32.dll, '' lets PyVisa find the default library,
+# e.g. VISA_LIBRARY = 'C:\\Windows\\System32\\visa32.dll'
+VISA_LIBRARY = ''
+
+_registry_lock = threading.Lock()
+_sessions = {}  # VISA address -> SharedSession
+_resource_manager = None
+
+
+# =========================================================
+# One pooled, lock-protected connection to an instrument:
+# =========================================================
+class SharedSession(object):
+    def __init__(self, address):
+        self.address = address
+        self.resource = None
+        self.refcount = 0
+        # Held for every single IO call.  Hold it yourself around
+        # multi-step transactions, e.g. write() followed by read_raw().
+        self.lock = threading.RLock()
+
+    def write(self, message):
+        with self.lock:
+            return self.resource.write(message)
+
+    def write_binary_values(self, message, values, *args, **kwargs):
+        with self.lock:
+            return self.resource.write_binary_values(message, values, *args, **kwargs)
+
+    def read_raw(self, *args, **kwargs):
+        with self.lock:
+            return self.resource.read_raw(*args, **kwargs)
+
+    def read_bytes(self, count, *args, **kwargs):
+        with self.lock:
+            return self.resource.read_bytes(count, *args, **kwargs)
+
+    def query(self, message):
+        with self.lock:
+            return self.resource.query(message)
+
+    def query_binary_values(self, message, *args, **kwargs):
+        with self.lock:
+            return self.resource.query_binary_values(message, *args, **kwargs)
+
+    def clear(self):
+        with self.lock:
+            self.resource.clear()
+
+    @property
+    def timeout(self):
+        return self.resource.timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self.resource.timeout = value
+
+    @property
+    def chunk_size(self):
+        return self.resource.chunk_size
+
+    @chunk_size.setter
+    def chunk_size(self, value):
+        self.resource.chunk_size = value
+
+    # Drops this user's reference; the last one closes the resource.
+    def close(self):
+        release_session(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# =========================================================
+# The resource manager is shared by all sessions:
+# =========================================================
+def _get_resource_manager():
+    # PyVisa is imported here, on the first real connection, so code
+    # run against simscope does not need it installed.
+    global _resource_manager
+    if _resource_manager is None:
+        import visa
+        _resource_manager = visa.ResourceManager(VISA_LIBRARY)
+    return _resource_manager
+
+
+# =========================================================
+# Get the shared session for an address, opening it once:
+# =========================================================
+def open_session(address=DEFAULT_VISA_ADDRESS, timeout=DEFAULT_TIMEOUT):
+    with _registry_lock:
+        session = _sessions.get(address)
+        if session is None:
+            session = SharedSession(address)
+            _sessions[address] = session
+        session.refcount += 1
+
+    # Opening is slow, so it happens outside the registry lock;
+    # other callers for the same address wait on the session lock.
+    with session.lock:
+        if session.resource is None:
+            try:
+                with _registry_lock:
+                    resource_manager = _get_resource_manager()
+                resource = resource_manager.open_resource(address)
+                resource.timeout = timeout
+                resource.clear()  # Clear the instrument bus, once.
+            except Exception:
+                release_session(session)
+                raise
+            session.resource = resource
+    return session
+
+
+# =========================================================
+# Release a session, closing it with the last reference:
+# =========================================================
+def release_session(session):
+    with _registry_lock:
+        session.refcount -= 1
+        if session.refcount > 0:
+            return
+        if _sessions.get(session.address) is session:
+            del _sessions[session.address]
+    _close_resource(session)
+
+
+def _close_resource(session):
+    with session.lock:
+        if session.resource is not None:
+            try:
+                session.resource.clear()
+            finally:
+                session.resource.close()
+                session.resource = None
+
+
+# =========================================================
+# Close every session still open, e.g. at interpreter exit:
+# =========================================================
+def close_all_sessions():
+    with _registry_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.refcount = 0
+        _close_resource(session)
+
+
+atexit.register(close_all_sessions)
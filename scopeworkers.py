@@ -0,0 +1,185 @@
+# *********************************************************
+# Background workers for the loadpic GUI.  Each worker runs
+# in its own QThread, talks to the oscilloscope there and
+# hands its newest result to the GUI thread via a signal.
+# *********************************************************
+# Import modules.
+# ---------------------------------------------------------
+import hashlib
+import threading
+import time
+from PyQt5.QtCore import QObject, QThread, QTimer, pyqtSignal, pyqtSlot
+from PyQt5.QtGui import QImage
+import measurev
+import screenshotsave
+
+
+# =========================================================
+# Calls poll() at most every interval_ms on a worker thread:
+# =========================================================
+class PollingWorker(QObject):
+    # Emitted when take_result() has something new.  Results that
+    # arrive while one is still waiting to be taken replace it, so
+    # a slow GUI only ever sees the latest value.
+    resultReady = pyqtSignal()
+    failed = pyqtSignal(str)
+    _refreshRequested = pyqtSignal()
+
+    def __init__(self, interval_ms):
+        super(PollingWorker, self).__init__()
+        self.interval_ms = interval_ms
+        self._force = True
+        self._timer = None
+        self._lock = threading.Lock()
+        self._result = None
+        self._delivery_pending = False
+
+        self._thread = QThread()
+        self.moveToThread(self._thread)
+        self._thread.started.connect(self._start_timer)
+        self._thread.finished.connect(self._stop_timer)
+        self._refreshRequested.connect(self._refresh)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._thread.quit()
+        self._thread.wait()
+
+    # Takes effect from the next poll.
+    def set_interval(self, interval_ms):
+        self.interval_ms = interval_ms
+
+    # Poll as soon as possible, even if poll() would skip it.
+    def request_refresh(self):
+        self._force = True
+        self._refreshRequested.emit()
+
+    def take_result(self):
+        with self._lock:
+            self._delivery_pending = False
+            return self._result
+
+    # Override; return None when there is nothing new to post.
+    def poll(self):
+        raise NotImplementedError
+
+    @pyqtSlot()
+    def _start_timer(self):
+        self._timer = QTimer()
+        self._timer.setSingleShot(True)  # Re-armed after each poll, so slow reads never pile up.
+        self._timer.timeout.connect(self._tick)
+        self._timer.start(0)
+
+    @pyqtSlot()
+    def _stop_timer(self):
+        if self._timer is not None:
+            self._timer.stop()
+
+    @pyqtSlot()
+    def _refresh(self):
+        if self._timer is not None:
+            self._timer.start(0)
+
+    @pyqtSlot()
+    def _tick(self):
+        started = time.monotonic()
+        try:
+            result = self.poll()
+        except Exception as e:
+            self.failed.emit(str(e))
+        else:
+            if result is not None:
+                self._publish(result)
+        # The time spent in poll() counts towards the interval.
+        elapsed_ms = (time.monotonic() - started) * 1000.0
+        self._timer.start(max(0, int(self.interval_ms - elapsed_ms)))
+
+    def _publish(self, result):
+        with self._lock:
+            self._result = result
+            if self._delivery_pending:
+                return
+            self._delivery_pending = True
+        self.resultReady.emit()
+
+
+# =========================================================
+# Re-reads a set of measurements while the scope is running:
+# =========================================================
+class MeasurementPoller(PollingWorker):
+    _commandRequested = pyqtSignal(str, bool)
+
+    def __init__(self, names, interval_ms=500, source=None):
+        super(MeasurementPoller, self).__init__(interval_ms)
+        self.names = list(names)
+        self.source = source
+        self._was_running = True
+        self._commandRequested.connect(self._command)
+
+    # Sends a command (e.g. from a button) on the worker thread, so the
+    # GUI never waits on the bus; refresh=True polls right after it.
+    def send_command(self, command, refresh=False):
+        self._commandRequested.emit(command, refresh)
+
+    @pyqtSlot(str, bool)
+    def _command(self, command, refresh):
+        try:
+            measurev.do_command(command)
+        except Exception as e:
+            self.failed.emit(str(e))
+        if refresh:
+            self._force = True
+            self._refresh()
+
+    def poll(self):
+        running = measurev.acquisition_running()
+        force = self._force
+        self._force = False
+        # Paused while STOPped: the capture is frozen, so after the
+        # reading taken on the transition there is nothing new.
+        if not running and not self._was_running and not force:
+            return None
+        self._was_running = running
+        return measurev.do_query_measurements(self.names, self.source)
+
+
+# =========================================================
+# Streams the scope screen as QImages, capped at max_fps:
+# =========================================================
+class ScreenshotStreamer(PollingWorker):
+    def __init__(self, max_fps=2.0, session=None):
+        super(ScreenshotStreamer, self).__init__(1000.0 / max_fps)
+        self.session = session
+        self.generation = None
+        self.frames = 0
+        self.skipped_frames = 0
+        self._last_digest = None
+
+    def set_max_fps(self, max_fps):
+        self.set_interval(1000.0 / max_fps)
+
+    def poll(self):
+        if self.generation is None:
+            if self.session is None:
+                self.session = screenshotsave.get_session()
+            self.generation = screenshotsave.scope_generation(self.session)
+            screenshotsave.prepare_screenshot(self.session)
+
+        raw = screenshotsave.read_screen_image(self.session, self.generation)
+        png = screenshotsave.decode_ieee_block(raw)
+
+        # An unchanged screen gives identical PNG bytes; don't decode
+        # or repaint it.
+        digest = hashlib.md5(png).digest()
+        if digest == self._last_digest:
+            self.skipped_frames += 1
+            return None
+        self._last_digest = digest
+        self.frames += 1
+
+        # Decoded here, off the GUI thread, straight from the read
+        # buffer. QPixmap may only be made on the GUI thread, so the
+        # receiver converts with QPixmap.fromImage().
+        return QImage.fromData(png.tobytes(), "PNG")
@@ -14,47 +14,29 @@ Tested with DSOX3000A/T-series, DSOX2000-series, DSOX4000-series (firmware: 2.41
 Tested with DSO6000-series (firmware: 6.20)
 """
 
-import visa
 import os  # needed to check the working directory
+import scopesession
+import chunktune
 
 # Replace the VISA address shown here with the VISA address of your InfiniiVision.
 # You'll find the VISA address within the IO Libraries installed on your PC.
 
 VISA_ADDRESS = "USB0::0x0957::0x179B::MY51452776::0::INSTR"
 
-# Directory path to visa32.dll so it can be used by pyVISA
-rm = visa.ResourceManager('C:\\Windows\\System32\\visa32.dll')  # this uses pyvisa
-## Open session using rm, which is the resource manager, and the visa address.
-GSInfiniivision = rm.open_resource(VISA_ADDRESS)
-## Set Global Timeout
-GSInfiniivision.timeout = 10000
-## Clear the instrument bus
-GSInfiniivision.clear()
+# Directory where the screen image is saved by default
+SAVE_DIRECTORY = 'D:\\Data'
+IMAGE_FILE_NAME = "Scope_Image.png"
 
-# Check Communication with the scope and print its name.
-IDN = GSInfiniivision.query("*IDN?")
-print(IDN)
+## The shared session is only opened when a screenshot is first asked for.
+## It is opened, given the timeout and cleared only by whichever module asks for it first.
+GSInfiniivision = None
 
-# Check whether scope is an older InfiniiVision or a newer X-Series InfiniiVision.
-# This is done by parsing the scope's identification string and looking for the 'X'.
-IDN = IDN.split(',')  # IDN parts are separated by commas, so parse on the commas
-# mfg = IDN[0] # Python indices start at 0
-model = IDN[1]
-# SN = IDN[2]
-# FW = IDN[3]
-
-scopeTypeCheck = list(model)
-if scopeTypeCheck[3] == "-" or scopeTypeCheck[1] == "9":
-    generation = "X_Series"
-else:
-    generation = "Older_Series"
-del IDN, scopeTypeCheck, model
-
-# Set the directory where you want the screen image to save
-os.chdir('D:\\Data')  # change the working directory
-workingdirectory = os.getcwd()  # check working directory again
 
-print("The working directory is now: " + workingdirectory)
+def get_session():
+    global GSInfiniivision
+    if GSInfiniivision is None:
+        GSInfiniivision = scopesession.open_session(VISA_ADDRESS, timeout=10000)
+    return GSInfiniivision
 
 
 ##############################################################################################################################################################################
@@ -63,6 +45,25 @@ print("The working directory is now: " + workingdirectory)
 ##############################################################################################################################################################################
 ##############################################################################################################################################################################
 
+# Check whether scope is an older InfiniiVision or a newer X-Series InfiniiVision.
+# This is done by parsing the scope's identification string and looking for the 'X'.
+def scope_generation(session):
+    # Check Communication with the scope and print its name.
+    IDN = session.query("*IDN?")
+    print(IDN)
+
+    IDN = IDN.split(',')  # IDN parts are separated by commas, so parse on the commas
+    # mfg = IDN[0] # Python indices start at 0
+    model = IDN[1]
+    # SN = IDN[2]
+    # FW = IDN[3]
+
+    scopeTypeCheck = list(model)
+    if scopeTypeCheck[3] == "-" or scopeTypeCheck[1] == "9":
+        return "X_Series"
+    else:
+        return "Older_Series"
+
 
 # The following function takes the raw PNG image data, which is an IEEE binary
 # block, and interprets the header.  The header tells us how many bytes are
@@ -98,32 +99,79 @@ def binblock_raw(data_in):
     return data_in[offset:offset + Image_Size]
 
 
+# Quiet version of binblock_raw() for repeated reads: parses the bytes
+# header directly and returns a memoryview of the image, without copying it.
+def decode_ieee_block(data_in):
+    startpos = data_in.find(b"#")
+    if startpos < 0:
+        raise IOError("No start of block found")
+    Size_of_Length = int(data_in[startpos + 1:startpos + 2])
+    Image_Size = int(data_in[startpos + 2:startpos + 2 + Size_of_Length])
+    offset = startpos + 2 + Size_of_Length
+    return memoryview(data_in)[offset:offset + Image_Size]
+
+
 ###########################################################################
 
 
-GSInfiniivision.query(':SYSTEM:DSP "";*OPC?')  # Turns off previously displayed (non-error) messages
-
-# The following command defines whether the image background will be black or white.
-# If you want to save ink, turn on this 'inksaver' setting.
-GSInfiniivision.write(":HARDCOPY:INKSAVER OFF")
-# Ask scope for screenshot in png format
-if generation == "Older_Series":
-    GSInfiniivision.write(":DISPlAY:DATA? PNG, SCREEN, COLOR")  # The older InfiniiVisions have 3 parameters
-elif generation == "X_Series":
-    GSInfiniivision.write(
-        ":DISPlAY:DATA? PNG, COLOR")  # The newer InfiniiVision-Xs do not have the middle parameter above
-
-Image_Data = GSInfiniivision.read_raw()
-print("Image has been read.\n")
-# Returns image data as a List of floating values
-Image_Data = binblock_raw(Image_Data)
-
-# open a file and write the data to it.
-# Feel free to change the file name.
-filename = workingdirectory + "\\Scope_Image.png"
-print(filename)
-gsfile = open(filename, "wb")  # wb means open for writing in binary; can overwrite
-print(str(gsfile))
-gsfile.write(Image_Data)
-gsfile.close()
+# One-off display setup before screen images are read.
+def prepare_screenshot(session):
+    session.query(':SYSTEM:DSP "";*OPC?')  # Turns off previously displayed (non-error) messages
+
+    # The following command defines whether the image background will be black or white.
+    # If you want to save ink, turn on this 'inksaver' setting.
+    session.write(":HARDCOPY:INKSAVER OFF")
+
+
+# Asks for the screen image in png format and returns the raw IEEE block.
+def read_screen_image(session, generation):
+    # The session is shared, so hold its lock until the reply has been read.
+    with session.lock:
+        if generation == "Older_Series":
+            session.write(":DISPlAY:DATA? PNG, SCREEN, COLOR")  # The older InfiniiVisions have 3 parameters
+        elif generation == "X_Series":
+            session.write(
+                ":DISPlAY:DATA? PNG, COLOR")  # The newer InfiniiVision-Xs do not have the middle parameter above
+
+        # Read in chunks of the size tuned for this address (chunktune).
+        return session.read_raw(chunktune.chunk_size_for(session))
+
+
+# Reads the screen image from the scope and returns the PNG file contents.
+def fetch_screenshot(session=None, generation=None):
+    if session is None:
+        session = get_session()
+    if generation is None:
+        generation = scope_generation(session)
+
+    prepare_screenshot(session)
+    Image_Data = read_screen_image(session, generation)
+    print("Image has been read.\n")
+    # Returns image data as a List of floating values
+    return binblock_raw(Image_Data)
+
+
+# Reads the screen image and writes it to a .png file.
+def save_screenshot(filename=None, session=None):
+    if filename is None:
+        filename = os.path.join(SAVE_DIRECTORY, IMAGE_FILE_NAME)
+    Image_Data = fetch_screenshot(session)
+
+    # open a file and write the data to it.
+    print(filename)
+    gsfile = open(filename, "wb")  # wb means open for writing in binary; can overwrite
+    print(str(gsfile))
+    gsfile.write(Image_Data)
+    gsfile.close()
+    return filename
+
+
+if __name__ == '__main__':
+    # Set the directory where you want the screen image to save
+    os.chdir(SAVE_DIRECTORY)  # change the working directory
+    workingdirectory = os.getcwd()  # check working directory again
+
+    print("The working directory is now: " + workingdirectory)
 
+    # Feel free to change the file name.
+    save_screenshot(workingdirectory + "\\" + IMAGE_FILE_NAME)
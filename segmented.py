@@ -0,0 +1,155 @@
+# *********************************************************
+# Segmented memory acquisition for the InfiniiVision scopes.
+# The scope captures N triggers back to back into segments
+# of its acquisition memory, at its own trigger rate; the
+# segments and their time tags are then downloaded in bulk
+# into one (segments, points) array per source.
+# *********************************************************
+# Import modules.
+# ---------------------------------------------------------
+import collections
+import time
+import numpy as np
+import chunktune
+import measurev
+import waveform
+
+# Global variables.
+# ---------------------------------------------------------
+TIME_TAGS_PER_QUERY = 100  # Segments per chained :TTAG? query
+
+# One segmented capture.  codes maps each source to its raw codes, shape
+# (segments, points); time_tags are the trigger times of the segments
+# relative to the first, in seconds; time_axis is the time axis within
+# a segment.
+SegmentedCapture = collections.namedtuple("SegmentedCapture", ["codes", "waveforms", "time_tags", "time_axis"])
+
+
+# =========================================================
+# Switch to segmented mode with count segments:
+# =========================================================
+def configure_segmented(session, count):
+    with measurev.using_instrument(session):
+        measurev.do_command(":ACQuire:MODE SEGMented;:ACQuire:SEGMented:COUNt %d" % count)
+
+
+# =========================================================
+# Back to normal (RTIMe) acquisitions:
+# =========================================================
+def configure_realtime(session):
+    with measurev.using_instrument(session):
+        measurev.do_command(":ACQuire:MODE RTIMe")
+
+
+# =========================================================
+# Arm a single segmented acquisition and wait until it is done:
+# =========================================================
+def acquire_segmented(session, timeout=60.0, poll_interval=0.05):
+    # The Run bit stays set until the last segment has triggered.
+    with measurev.using_instrument(session):
+        measurev.do_command(":SINGle")
+        measurev.do_query_string("*OPC?")  # :SINGle has been processed.
+        deadline = time.time() + timeout
+        while measurev.acquisition_running():
+            if time.time() >= deadline:
+                raise IOError("Timed out waiting for the segmented acquisition to finish")
+            time.sleep(poll_interval)
+        return int(measurev.do_query_number(":WAVeform:SEGMented:COUNt?"))
+
+
+# =========================================================
+# Time tags of segments 1..count, a batch of segments per query:
+# =========================================================
+def read_time_tags(session, count):
+    time_tags = np.empty(count)
+    for first in range(1, count + 1, TIME_TAGS_PER_QUERY):
+        last = min(count, first + TIME_TAGS_PER_QUERY - 1)
+        query = ";".join(":ACQuire:SEGMented:INDex %d;:WAVeform:SEGMented:TTAG?" % index
+                         for index in range(first, last + 1))
+        values = session.query(query).strip().split(";")
+        if len(values) != last - first + 1:
+            raise IOError("Expected %d time tags for segments %d to %d, got %d"
+                          % (last - first + 1, first, last, len(values)))
+        time_tags[first - 1:last] = [float(value) for value in values]
+    return time_tags
+
+
+# =========================================================
+# Can the scope return every segment in one :DATA? block?
+# =========================================================
+def _enable_all_segments(session):
+    # :WAVeform:SEGMented:ALL only exists on some models; an error from
+    # it means the segments have to be read one by one.  Errors already
+    # queued are reported first (as measurev.InstrumentError), so the
+    # queue only holds what the probe caused and nothing a deferred
+    # error-check policy still has to report is dropped.
+    with measurev.using_instrument(session):
+        measurev.flush_instrument_errors()
+    reply = session.query(":WAVeform:SEGMented:ALL ON;:SYSTem:ERRor?")
+    if int(reply.split(",")[0]) == 0:
+        return True
+    while int(session.query(":SYSTem:ERRor?").split(",")[0]) != 0:
+        pass
+    return False
+
+
+# =========================================================
+# Download every segment of one source into out:
+# =========================================================
+def download_segments(session, source, out, chunk_size=None, all_segments=None):
+    # out has shape (segments, points) and the dtype of the current
+    # :WAVeform:FORMat.  all_segments is None to find out whether the
+    # scope supports :WAVeform:SEGMented:ALL, or True/False if known.
+    if chunk_size is None:
+        chunk_size = chunktune.chunk_size_for(session, waveform.DEFAULT_CHUNK_SIZE)
+    with session.lock:
+        if all_segments is None:
+            all_segments = _enable_all_segments(session)
+        elif all_segments:
+            session.write(":WAVeform:SEGMented:ALL ON")
+
+        if all_segments:
+            try:
+                received = waveform.fetch_waveform_into(session, source, out, chunk_size)
+            finally:
+                session.write(":WAVeform:SEGMented:ALL OFF")
+            if received != out.size:
+                raise IOError("%s: expected %d samples of %d segments, got %d"
+                              % (source, out.size, len(out), received))
+        else:
+            for (index, row) in enumerate(out, 1):
+                session.write(":ACQuire:SEGMented:INDex %d;:WAVeform:SOURce %s;DATA?" % (index, source))
+                received = waveform.read_ieee_block_into(session, row, chunk_size)
+                if received != len(row):
+                    raise IOError("%s segment %d: expected %d samples, got %d"
+                                  % (source, index, len(row), received))
+    return all_segments
+
+
+# =========================================================
+# Acquire count segments and download them with their time tags:
+# =========================================================
+def capture_segmented(session, sources, count, fmt=None, timeout=60.0,
+                      chunk_size=None):
+    # sources are e.g. ["CHANnel1", "CHANnel2"]; :WAVeform:FORMat is set
+    # to fmt, or chosen from the acquisition type if fmt is None.  The
+    # scope is left in segmented mode, ready for the next
+    # capture_segmented() with the same count.
+    configure_segmented(session, count)
+    acquired = acquire_segmented(session, timeout)
+    with session.lock:
+        if fmt is None:
+            fmt = waveform.choose_format(session.query(":ACQuire:TYPE?"))
+        waveform.configure_format(session, fmt)
+        session.write(":WAVeform:POINts:MODE RAW")
+        time_tags = read_time_tags(session, acquired)
+        codes = collections.OrderedDict()
+        waveforms = collections.OrderedDict()
+        all_segments = None
+        for source in sources:
+            preamble = session.query(":WAVeform:SOURce %s;PREamble?" % source)
+            points = int(float(preamble.split(",")[2]))
+            codes[source] = waveform.allocate_waveform_buffer(points, acquired, fmt)
+            all_segments = download_segments(session, source, codes[source], chunk_size, all_segments)
+            waveforms[source] = waveform.Waveform.from_preamble(codes[source], preamble, source=source)
+    return SegmentedCapture(codes, waveforms, time_tags, waveform.TimeAxis.from_preamble(preamble))
@@ -0,0 +1,270 @@
+# *********************************************************
+# A simulated InfiniiVision oscilloscope for benchmarks.
+# It understands the SCPI subset our modules send and looks
+# like a scopesession.SharedSession (write/query/read_bytes/
+# read_raw/lock), so the real code paths run against it
+# without an instrument or VISA installed.
+# *********************************************************
+# Import modules.
+# ---------------------------------------------------------
+import re
+import struct
+import threading
+import time
+import numpy as np
+
+# :WAVeform:PREamble? format and acquisition type codes.
+PREAMBLE_FORMATS = {"BYTE": 0, "WORD": 1}
+PREAMBLE_TYPES = {"NORM": 0, "PEAK": 1, "AVER": 2, "HRES": 3}
+
+
+# =========================================================
+# Simulated scope:
+# =========================================================
+class SimulatedScope(object):
+    def __init__(self, points=1000, channels=4, latency=0.0,
+                 model="DSO-X 3034A", acq_type="NORM", segmented_all=True,
+                 bandwidth=None, screen_bytes=65536):
+        self.address = "SIM::%s" % model
+        self.points = points
+        self.channels = channels
+        self.latency = latency  # Seconds added to every write/query.
+        self.bandwidth = bandwidth  # Bytes per second of reads, or None for no limit.
+        self.screen_bytes = screen_bytes  # Size of the :DISPlay:DATA? image.
+        self.model = model
+        self.segmented_all = segmented_all  # Supports :WAVeform:SEGMented:ALL
+        # Headers (upper case long form, without "?") the scope rejects
+        # as undefined, e.g. to exercise error handling.
+        self.undefined_headers = set()
+        self.timeout = 10000
+        self.chunk_size = 20480
+        self.lock = threading.RLock()
+        self.settings = {
+            ":WAVEFORM:FORMAT": "WORD",
+            ":WAVEFORM:SOURCE": "CHAN1",
+            ":WAVEFORM:UNSIGNED": "0",
+            ":ACQUIRE:TYPE": acq_type,
+            ":ACQUIRE:MODE": "RTIM",
+            ":ACQUIRE:SEGMENTED:COUNT": "2",
+            ":ACQUIRE:SEGMENTED:INDEX": "1",
+            ":WAVEFORM:SEGMENTED:ALL": "OFF",
+        }
+        self.errors = []
+        self.esr = 0  # *ESR? event status bits, cleared when read
+        self.queries = 0
+        self._output = memoryview(b"")
+        self._codes = {}
+        self._blocks = {}
+
+    # -----------------------------------------------------
+    # VISA session interface
+    # -----------------------------------------------------
+    def write(self, message):
+        with self.lock:
+            if self.latency:
+                time.sleep(self.latency)
+            self._output = memoryview(self._execute(message))
+
+    def read_bytes(self, count, chunk_size=None, break_on_termchar=False):
+        with self.lock:
+            data = self._output[:count].tobytes()
+            self._output = self._output[count:]
+            self._transfer_delay(len(data))
+            return data
+
+    def read_raw(self, size=None):
+        with self.lock:
+            data = self._output.tobytes()
+            self._output = memoryview(b"")
+            self._transfer_delay(len(data))
+            return data
+
+    def read(self):
+        return self.read_raw().decode("ascii")
+
+    def query(self, message):
+        with self.lock:
+            self.queries += 1
+            self.write(message)
+            return self.read()
+
+    # Does the same work as PyVisa's query_binary_values(): parse the
+    # block header and unpack every sample into a Python container.
+    def query_binary_values(self, message, datatype='f', is_big_endian=False, container=list):
+        with self.lock:
+            self.write(message)
+            block = self.read_raw()
+        digits = int(block[1:2])
+        length = int(block[2:2 + digits])
+        count = length // struct.calcsize(datatype)
+        fmt = "%s%d%s" % (">" if is_big_endian else "<", count, datatype)
+        return container(struct.unpack_from(fmt, block, 2 + digits))
+
+    # Emulates a link of self.bandwidth bytes per second.
+    def _transfer_delay(self, size):
+        if self.bandwidth:
+            time.sleep(size / float(self.bandwidth))
+
+    def clear(self):
+        self._output = memoryview(b"")
+
+    def close(self):
+        pass
+
+    # -----------------------------------------------------
+    # SCPI handling
+    # -----------------------------------------------------
+    def _execute(self, message):
+        replies = []
+        path = ""
+        for part in message.split(";"):
+            part = part.strip()
+            if not part:
+                continue
+            (header, _, argument) = part.partition(" ")
+            header = header.upper()
+            if not header.startswith((":", "*")):  # Relative to the previous header.
+                header = path + ":" + header
+            if not header.startswith("*"):
+                path = header.rsplit(":", 1)[0]
+            if header.rstrip("?") in self.undefined_headers or (
+                    header == ":WAVEFORM:SEGMENTED:ALL" and not self.segmented_all):
+                # Like the scope: no reply, an error queued and the
+                # command error bit set.
+                self.errors.append('-113,"Undefined header"')
+                self.esr |= 0x20
+            elif header.endswith("?"):
+                replies.append(self._query(header[:-1], argument.strip()))
+            else:
+                self.settings[header] = argument.strip().upper()
+
+        if len(replies) == 1 and isinstance(replies[0], bytes):
+            return replies[0]
+        return (";".join(replies) + "\n").encode("ascii")
+
+    def _source_channel(self):
+        match = re.search(r"(\d+)$", self.settings[":WAVEFORM:SOURCE"])
+        return int(match.group(1)) if match else 1
+
+    def _format(self):
+        return self.settings[":WAVEFORM:FORMAT"][:4]
+
+    def _preamble(self):
+        fmt = self._format()
+        if fmt == "BYTE":
+            (y_increment, y_reference) = (8.0 / 200.0, 128.0)
+        else:
+            (y_increment, y_reference) = (8.0 / 51200.0, 0.0)
+        return [PREAMBLE_FORMATS[fmt], PREAMBLE_TYPES.get(self.settings[":ACQUIRE:TYPE"], 0),
+                self.points, 1, 1.0e-9, -0.5e-9 * self.points, 0.0,
+                y_increment, 0.0, y_reference]
+
+    def _query(self, header, argument):
+        if header == "*IDN":
+            return "KEYSIGHT TECHNOLOGIES,%s,SIM00001,07.20.2017102615" % self.model
+        if header == "*OPC":
+            return "1"
+        if header == "*ESR":
+            (esr, self.esr) = (self.esr, 0)
+            return "%d" % esr
+        if header == ":SYSTEM:ERROR":
+            return self.errors.pop(0) if self.errors else '+0,"No error"'
+        if header == ":WAVEFORM:PREAMBLE":
+            return ",".join("%s" % value for value in self._preamble())
+        if header == ":WAVEFORM:POINTS":
+            return "%d" % self.points
+        if header == ":WAVEFORM:FORMAT":
+            return self._format()
+        if header == ":WAVEFORM:DATA":
+            return self._data_block()
+        if header == ":DISPLAY:DATA":
+            return self._screen_block()
+        if header == ":ACQUIRE:TYPE":
+            return self.settings[":ACQUIRE:TYPE"]
+        if header.startswith(":CHANNEL") and header.endswith(":DISPLAY"):
+            return "1" if int(header[8:-8]) <= self.channels else "0"
+        if header.startswith(":POD") and header.endswith(":DISPLAY"):
+            return "1" if self.model.startswith("MSO") else "0"
+        if header.startswith(":CHANNEL") and header.endswith(":UNITS"):
+            return "VOLT"
+        if header == ":WAVEFORM:SEGMENTED:COUNT":
+            return "%d" % self._segments() if self._segmented() else "0"
+        if header == ":WAVEFORM:SEGMENTED:TTAG":
+            return "%.6E" % ((int(self.settings[":ACQUIRE:SEGMENTED:INDEX"]) - 1) * 1.0e-3)
+        if header == ":OPEREGISTER:CONDITION":
+            return "0"
+        if header.startswith(":MEASURE:"):
+            return "+1.00000E+00"
+        return self.settings.get(header, "0")
+
+    # -----------------------------------------------------
+    # Waveform data: a noisy sine wave per channel
+    # -----------------------------------------------------
+    def waveform_codes(self, channel, fmt=None):
+        fmt = fmt or self._format()
+        key = (channel, fmt, self.points)
+        if key not in self._codes:
+            rng = np.random.RandomState(channel)
+            phase = np.linspace(0.0, 20.0 * np.pi, self.points) + channel
+            volts = 3.0 * np.sin(phase) + 0.01 * rng.standard_normal(self.points)
+            if fmt == "BYTE":
+                codes = np.clip(np.round(volts / (8.0 / 200.0) + 128.0), 0, 255).astype("u1")
+            else:
+                codes = np.round(volts / (8.0 / 51200.0)).astype("<i2")
+            self._codes[key] = codes
+        return self._codes[key]
+
+    def _segmented(self):
+        return self.settings[":ACQUIRE:MODE"].startswith("SEGM")
+
+    def _segments(self):
+        return int(self.settings[":ACQUIRE:SEGMENTED:COUNT"])
+
+    # Segment n (from 1) is the channel's waveform shifted by n samples.
+    def _segment_codes(self, channel, fmt):
+        codes = self.waveform_codes(channel, fmt)
+        if self.settings[":WAVEFORM:SEGMENTED:ALL"] in ("ON", "1"):
+            return np.concatenate([np.roll(codes, n) for n in range(1, self._segments() + 1)])
+        return np.roll(codes, int(self.settings[":ACQUIRE:SEGMENTED:INDEX"]))
+
+    # Digital pods: D0-D7 (POD1) or D8-D15 (POD2), each bit a square
+    # wave with its own period, one byte per point in BYTE format.
+    def pod_codes(self, pod, fmt=None):
+        fmt = fmt or self._format()
+        key = ("POD%d" % pod, fmt, self.points)
+        if key not in self._codes:
+            sample = np.arange(self.points, dtype=np.int64)
+            bits = [(sample // (3 + 2 * (8 * (pod - 1) + bit)) % 2) << bit for bit in range(8)]
+            codes = np.bitwise_or.reduce(bits).astype("u1")
+            self._codes[key] = codes if fmt == "BYTE" else codes.astype("<i2")
+        return self._codes[key]
+
+    @staticmethod
+    def _block(data):
+        length = "%d" % len(data)
+        return b"#" + ("%d" % len(length)).encode("ascii") + length.encode("ascii") + data + b"\n"
+
+    # Blocks are built once and kept, so repeated :WAVeform:DATA?
+    # queries cost the controller side only.
+    def _data_block(self):
+        source = self.settings[":WAVEFORM:SOURCE"]
+        if source.startswith("POD"):
+            key = (source[:3], self._source_channel(), self._format(), self.points)
+            if key not in self._blocks:
+                self._blocks[key] = self._block(self.pod_codes(key[1]).tobytes())
+            return self._blocks[key]
+        if self._segmented():
+            return self._block(self._segment_codes(self._source_channel(), self._format()).tobytes())
+        key = (self._source_channel(), self._format(), self.points)
+        if key not in self._blocks:
+            self._blocks[key] = self._block(self.waveform_codes(key[0], key[1]).tobytes())
+        return self._blocks[key]
+
+    # Screen image: a PNG signature followed by screen_bytes - 8 bytes
+    # of noise, which is as incompressible as real PNG data.
+    def _screen_block(self):
+        key = ("SCREEN", self.screen_bytes)
+        if key not in self._blocks:
+            noise = np.random.RandomState(0).randint(0, 256, self.screen_bytes - 8).astype("u1")
+            self._blocks[key] = self._block(b"\x89PNG\r\n\x1a\n" + noise.tobytes())
+        return self._blocks[key]
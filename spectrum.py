@@ -0,0 +1,162 @@
+# *********************************************************
+# Spectra of captured waveforms: window, rfft and scaling to
+# RMS volts per bin (dBV, as the scope's FFT shows it), for
+# every channel and capture of a (..., points) array in one
+# call.  Windows are built once per (name, length) and kept.
+# WelchAverager averages spectra over a long series of
+# captures one capture at a time, so the series never has to
+# be held in memory.
+# *********************************************************
+# Import modules.
+# ---------------------------------------------------------
+import functools
+import numpy as np
+import waveform
+
+# Global variables.
+# ---------------------------------------------------------
+# Cosine-sum coefficients of the periodic (DFT-even) windows.
+WINDOWS = {
+    "rectangular": (1.0,),
+    "hann": (0.5, 0.5),
+    "hamming": (0.54, 0.46),
+    "blackman": (0.42, 0.5, 0.08),
+    "flattop": (0.21557895, 0.41663158, 0.277263158, 0.083578947, 0.006947368),
+}
+DEFAULT_WINDOW = "hann"
+DBV_FLOOR = 1e-12  # Vrms shown as -240 dBV instead of -inf
+
+
+# =========================================================
+# Window of points samples, built on first use:
+# =========================================================
+@functools.lru_cache(maxsize=32)
+def window(name, points):
+    # Read-only, as the same array is handed to every caller.
+    if name not in WINDOWS:
+        raise ValueError("Unknown window '%s', expected one of %s" % (name, ", ".join(sorted(WINDOWS))))
+    phase = 2.0 * np.pi * np.arange(points) / points
+    values = np.zeros(points)
+    for (k, a) in enumerate(WINDOWS[name]):
+        values += (-1) ** k * a * np.cos(k * phase)
+    values.flags.writeable = False
+    return values
+
+
+# =========================================================
+# Per-bin factors from |rfft| of a windowed record to Vrms:
+# =========================================================
+@functools.lru_cache(maxsize=32)
+def _rms_factors(name, points):
+    # A sine of peak amplitude A gives |X| = A * sum(w) / 2 in its bin,
+    # i.e. Vrms = |X| * sqrt(2) / sum(w); DC (and the Nyquist bin of an
+    # even length record) have no mirror image, so Vrms = |X| / sum(w).
+    factors = np.full(points // 2 + 1, np.sqrt(2.0) / window(name, points).sum())
+    factors[0] /= np.sqrt(2.0)
+    if points % 2 == 0:
+        factors[-1] /= np.sqrt(2.0)
+    factors.flags.writeable = False
+    return factors
+
+
+def frequencies(points, x_increment):
+    return np.fft.rfftfreq(points, x_increment)
+
+
+def _volts(y):
+    # A waveform.Waveform is scaled; anything else is taken as volts.
+    if isinstance(y, waveform.Waveform):
+        return y.scaled()
+    return np.asarray(y, dtype=np.float64)
+
+
+# =========================================================
+# Spectrum of every row:
+# =========================================================
+def spectrum(y, x_increment, window_name=DEFAULT_WINDOW):
+    # y has shape (..., points), in volts, e.g. Wav_Data.T or a stack of
+    # captures (captures, channels, points); or is a waveform.Waveform.
+    # Returns (frequencies, rms), rms of shape (..., points // 2 + 1) in
+    # Vrms per bin, all rows transformed by one rfft call.
+    y = _volts(y)
+    points = y.shape[-1]
+    transformed = np.fft.rfft(y * window(window_name, points), axis=-1)
+    return frequencies(points, x_increment), np.abs(transformed) * _rms_factors(window_name, points)
+
+
+def dbv(rms, floor=DBV_FLOOR):
+    # 0 dBV is 1 Vrms.
+    return 20.0 * np.log10(np.maximum(rms, floor))
+
+
+# =========================================================
+# Power average of the spectra along one axis (e.g. captures):
+# =========================================================
+def average_spectrum(y, x_increment, window_name=DEFAULT_WINDOW, axis=0):
+    # RMS averaging, as the scope's FFT averaging does: the powers are
+    # averaged, which lowers the noise floor's variance but not its level.
+    (freqs, rms) = spectrum(y, x_increment, window_name)
+    return freqs, np.sqrt(np.mean(np.square(rms), axis=axis))
+
+
+# =========================================================
+# Streaming Welch-style average:
+# =========================================================
+class WelchAverager(object):
+    # Each capture given to add() is cut into segments of segment points
+    # overlapping by overlap (a fraction), every segment is windowed and
+    # transformed, and the powers are summed; only the running sum is
+    # kept.  Captures are separate acquisitions, so segments never span
+    # two of them.  segment=None uses each capture whole, and then all
+    # captures must have the same length.  All captures must have the
+    # same leading shape, e.g. (channels,).
+    def __init__(self, x_increment, segment=None, overlap=0.5, window_name=DEFAULT_WINDOW):
+        if not 0.0 <= overlap < 1.0:
+            raise ValueError("overlap must be at least 0 and less than 1")
+        self.x_increment = x_increment
+        self.segment = segment
+        self.overlap = overlap
+        self.window_name = window_name
+        self.points = segment  # Length of the transformed segments
+        self.count = 0  # Segments averaged so far, per row
+        self._power = None
+
+    def add(self, y):
+        y = _volts(y)
+        segment = self.points = self.points or y.shape[-1]
+        if y.shape[-1] < segment:
+            raise ValueError("A capture of %d points is shorter than one segment (%d)" % (y.shape[-1], segment))
+        step = max(1, int(round(segment * (1.0 - self.overlap))))
+        # (..., segments, segment) view of the capture, then one rfft.
+        segments = np.lib.stride_tricks.sliding_window_view(y, segment, axis=-1)[..., ::step, :]
+        transformed = np.fft.rfft(segments * window(self.window_name, segment), axis=-1)
+        power = np.square(np.abs(transformed) * _rms_factors(self.window_name, segment)).sum(axis=-2)
+        if self._power is None:
+            self._power = power
+        else:
+            self._power += power
+        self.count += segments.shape[-2]
+        return self
+
+    @property
+    def frequencies(self):
+        return frequencies(self.points, self.x_increment)
+
+    # Averaged spectrum in Vrms per bin, shape (..., segment // 2 + 1).
+    @property
+    def rms(self):
+        return np.sqrt(self._power / self.count)
+
+    def dbv(self, floor=DBV_FLOOR):
+        return dbv(self.rms, floor)
+
+    # Power spectral density in V^2/Hz, for noise measurements.
+    @property
+    def psd(self):
+        w = window(self.window_name, self.points)
+        # Undo the Vrms scaling and apply the density scaling instead.
+        scale = np.square(1.0 / _rms_factors(self.window_name, self.points)) * (self.x_increment / np.square(w).sum())
+        scale[1:] *= 2.0
+        if self.points % 2 == 0:
+            scale[-1] /= 2.0
+        return self._power / self.count * scale
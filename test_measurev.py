@@ -0,0 +1,95 @@
+# *********************************************************
+# Tests of the measurev measurement cache and error checks
+# against simscope.
+#
+# Usage: python -m unittest test_measurev
+# *********************************************************
+# Import modules.
+# ---------------------------------------------------------
+import unittest
+import measurev
+import simscope
+
+
+# =========================================================
+# Measurement cache:
+# =========================================================
+class MeasurementCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.scope = simscope.SimulatedScope()
+        self.using = measurev.using_instrument(self.scope)
+        self.using.__enter__()
+
+    def tearDown(self):
+        self.using.__exit__(None, None, None)
+
+    # Bus queries made by function().
+    def queries(self, function):
+        before = self.scope.queries
+        function()
+        return self.scope.queries - before
+
+    def test_frozen_capture_is_cached(self):
+        measurev.do_command(":STOP")
+        measurev.do_query_number(":MEASure:VMAX?")
+        self.assertEqual(self.queries(lambda: measurev.do_query_number(":MEASure:VMAX?")), 0)
+
+    def test_source_change_invalidates(self):
+        measurev.do_command(":STOP")
+        measurev.do_query_number(":MEASure:VMAX?")
+        measurev.do_command(":MEASure:SOURce CHANnel2")
+        self.assertGreater(self.queries(lambda: measurev.do_query_number(":MEASure:VMAX?")), 0)
+
+    def test_statistics_reset_invalidates(self):
+        measurev.do_command(":STOP")
+        measurev.do_query_string(":MEASure:RESults?")
+        self.assertEqual(self.queries(lambda: measurev.do_query_string(":MEASure:RESults?")), 0)
+        measurev.enable_measurement_statistics(reset=True)
+        self.assertGreater(self.queries(lambda: measurev.do_query_string(":MEASure:RESults?")), 0)
+        measurev.do_query_string(":MEASure:RESults?")
+        measurev.do_command(":MEASure:CLEar")
+        self.assertGreater(self.queries(lambda: measurev.do_query_string(":MEASure:RESults?")), 0)
+
+    def test_header_without_colon(self):
+        measurev.do_command("STOP")
+        self.assertTrue(measurev.get_measurement_cache().frozen)
+        measurev.do_query_number(":MEASure:VMAX?")
+        measurev.do_command("RUN")
+        self.assertFalse(measurev.get_measurement_cache().frozen)
+        self.assertGreater(self.queries(lambda: measurev.do_query_number(":MEASure:VMAX?")), 0)
+
+
+# =========================================================
+# ESR error-check policy:
+# =========================================================
+class EsrPolicyTest(unittest.TestCase):
+    def setUp(self):
+        self.scope = simscope.SimulatedScope()
+        self.scope.undefined_headers.add(":MEASURE:BOGUS")
+        self.using = measurev.using_instrument(self.scope)
+        self.using.__enter__()
+        measurev.set_error_check_policy(measurev.ERROR_CHECK_ESR)
+
+    def tearDown(self):
+        measurev.set_error_check_policy(measurev.ERROR_CHECK_COMMAND)
+        self.using.__exit__(None, None, None)
+
+    def test_rejected_query_raises_instrument_error(self):
+        for query in (measurev.do_query_number, measurev.do_query_string):
+            with self.assertRaises(measurev.InstrumentError) as raised:
+                query(":MEASURE:BOGUS?")
+            self.assertIn('-113,"Undefined header"', raised.exception.errors)
+            self.assertEqual(self.scope.errors, [])  # The queue was drained.
+
+    def test_rejected_command_raises_instrument_error(self):
+        with self.assertRaises(measurev.InstrumentError):
+            measurev.do_command(":MEASURE:BOGUS CHANnel1")
+        self.assertEqual(self.scope.errors, [])
+
+    def test_accepted_query(self):
+        self.assertEqual(measurev.do_query_number(":MEASure:VMAX?"), 1.0)
+        self.assertEqual(measurev.do_query_measurements(["VMAX", "VMIN"]), {"VMAX": 1.0, "VMIN": 1.0})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+# *********************************************************
+# Append-only archive of waveform captures.  The raw sample
+# codes of every capture go, one after another, into a .raw
+# file of int16; a .idx file holds one fixed size record per
+# capture (timestamp, preambles, acquisition type, sources,
+# offset).  Both are read through np.memmap, so captures can
+# be appended and read back in any order without loading the
+# archive.
+# *********************************************************
+# Import modules.
+# ---------------------------------------------------------
+import collections
+import os
+import threading
+import time
+import numpy as np
+import waveform
+
+# Global variables.
+# ---------------------------------------------------------
+MAGIC = b"WFMARCH2"  # First 8 bytes of every .idx file
+MAX_CHANNELS = 4
+SAMPLE_DTYPE = np.dtype("<i2")
+
+# One .idx record.  offset and points count samples; the capture is
+# stored channel after channel, channels * points samples in all.
+# repeat is 2 for PEAK captures, whose samples are Low,High pairs per
+# time point (see waveform.TimeAxis), else 1.
+INDEX_DTYPE = np.dtype([
+    ("timestamp", "<f8"),
+    ("offset", "<i8"),
+    ("points", "<i8"),
+    ("channels", "<i4"),
+    ("x_increment", "<f8"),
+    ("x_origin", "<f8"),
+    ("x_reference", "<f8"),
+    ("y_increment", "<f8", (MAX_CHANNELS,)),
+    ("y_origin", "<f8", (MAX_CHANNELS,)),
+    ("y_reference", "<f8", (MAX_CHANNELS,)),
+    ("sources", "S12", (MAX_CHANNELS,)),
+    ("units", "S4", (MAX_CHANNELS,)),
+    ("acq_type", "S4"),
+    ("repeat", "<i4"),
+])
+
+# One capture read back.  waveforms are waveform.Waveform objects
+# whose codes are views into the memory mapped .raw file; time_axis is
+# a waveform.TimeAxis that pairs PEAK Low,High samples.
+Capture = collections.namedtuple("Capture", ["timestamp", "x_increment", "x_origin", "x_reference", "waveforms",
+                                             "acq_type", "time_axis"])
+
+
+# =========================================================
+# Waveform archive:
+# =========================================================
+class WaveformArchive(object):
+    # path is the archive name without extension; path.raw and path.idx
+    # are created if they do not exist.
+    def __init__(self, path):
+        self.path = path
+        self.raw_path = path + ".raw"
+        self.index_path = path + ".idx"
+        self._lock = threading.Lock()
+        self._index = None
+        self._data = None
+        if not os.path.exists(self.index_path):
+            with open(self.index_path, "wb") as f:
+                f.write(MAGIC)
+            open(self.raw_path, "wb").close()
+        with open(self.index_path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise IOError("%s is not a waveform archive index" % self.index_path)
+
+    # Appends one capture and returns its number.  waveforms is a list
+    # of waveform.Waveform with equal length codes, one per channel;
+    # acq_type is the :ACQuire:TYPE? reply (NORM, PEAK, HRES, AVER).
+    # The samples are written before the index record, so an
+    # interrupted append never leaves a record without its data.
+    def append(self, waveforms, x_increment, x_origin, x_reference, timestamp=None, acq_type="NORM"):
+        if not 0 < len(waveforms) <= MAX_CHANNELS:
+            raise ValueError("A capture holds 1 to %d channels" % MAX_CHANNELS)
+        points = len(waveforms[0].codes)
+        record = np.zeros(1, dtype=INDEX_DTYPE)
+        record["timestamp"] = time.time() if timestamp is None else timestamp
+        record["points"] = points
+        record["channels"] = len(waveforms)
+        record["x_increment"] = x_increment
+        record["x_origin"] = x_origin
+        record["x_reference"] = x_reference
+        record["acq_type"] = acq_type.strip().upper()[:4].encode("ascii")
+        record["repeat"] = 2 if acq_type.strip().upper().startswith("PEAK") else 1
+        for (i, wave) in enumerate(waveforms):
+            if len(wave.codes) != points:
+                raise ValueError("All channels of a capture must have the same number of points")
+            record["y_increment"][0, i] = wave.y_increment
+            record["y_origin"][0, i] = wave.y_origin
+            record["y_reference"][0, i] = wave.y_reference
+            record["sources"][0, i] = (wave.source or "").encode("ascii")
+            record["units"][0, i] = (wave.units or "").encode("ascii")
+
+        with self._lock:
+            with open(self.raw_path, "ab") as f:
+                record["offset"] = f.tell() // SAMPLE_DTYPE.itemsize
+                for wave in waveforms:
+                    # BYTE codes (uint8) are widened; WORD codes are written as they are.
+                    f.write(np.ascontiguousarray(wave.codes, dtype=SAMPLE_DTYPE).data)
+            with open(self.index_path, "ab") as f:
+                f.write(record.tobytes())
+            return (os.path.getsize(self.index_path) - len(MAGIC)) // INDEX_DTYPE.itemsize - 1
+
+    # The index as a memory mapped record array, remapped when the file
+    # has grown since the last call.
+    @property
+    def index(self):
+        count = (os.path.getsize(self.index_path) - len(MAGIC)) // INDEX_DTYPE.itemsize
+        if self._index is None or len(self._index) != count:
+            if count == 0:
+                self._index = np.zeros(0, dtype=INDEX_DTYPE)
+            else:
+                self._index = np.memmap(self.index_path, dtype=INDEX_DTYPE, mode="r",
+                                        offset=len(MAGIC), shape=(count,))
+        return self._index
+
+    def _samples(self, end):
+        if self._data is None or len(self._data) < end:
+            self._data = np.memmap(self.raw_path, dtype=SAMPLE_DTYPE, mode="r")
+        return self._data
+
+    def __len__(self):
+        return len(self.index)
+
+    # Raw codes of one capture, shape (channels, points), without copying.
+    def codes(self, number):
+        record = self.index[number]
+        start = int(record["offset"])
+        end = start + int(record["channels"]) * int(record["points"])
+        return self._samples(end)[start:end].reshape(int(record["channels"]), int(record["points"]))
+
+    # Raw codes of captures first..stop-1, shape (captures, channels,
+    # points), without copying.  The captures must have the same shape
+    # and be stored back to back, as captures appended in a row are.
+    def block_codes(self, first, stop):
+        records = self.index[first:stop]
+        (channels, points) = (int(records["channels"][0]), int(records["points"][0]))
+        size = channels * points
+        start = int(records["offset"][0])
+        if (np.any(records["channels"] != channels) or np.any(records["points"] != points)
+                or np.any(records["offset"] != start + size * np.arange(len(records)))):
+            raise ValueError("Captures %d to %d are not stored as one block" % (first, stop - 1))
+        end = start + len(records) * size
+        return self._samples(end)[start:end].reshape(len(records), channels, points)
+
+    def __getitem__(self, number):
+        record = self.index[number]
+        codes = self.codes(number)
+        waveforms = [waveform.Waveform(codes[i], record["y_increment"][i], record["y_origin"][i],
+                                       record["y_reference"][i], record["units"][i].decode("ascii"),
+                                       record["sources"][i].decode("ascii"))
+                     for i in range(int(record["channels"]))]
+        repeat = int(record["repeat"])
+        time_axis = waveform.TimeAxis(int(record["points"]) // repeat, record["x_increment"],
+                                      record["x_origin"], record["x_reference"], repeat)
+        return Capture(float(record["timestamp"]), float(record["x_increment"]),
+                       float(record["x_origin"]), float(record["x_reference"]), waveforms,
+                       record["acq_type"].decode("ascii"), time_axis)
+
+    def __iter__(self):
+        for number in range(len(self)):
+            yield self[number]
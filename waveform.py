@@ -0,0 +1,477 @@
+# *********************************************************
+# Waveform transfer for the InfiniiVision oscilloscopes.
+# :WAVeform:DATA? blocks are read straight into preallocated
+# NumPy buffers, chunk by chunk, instead of being unpacked
+# into a Python list and copied into an array afterwards.
+# *********************************************************
+# Import modules.
+# ---------------------------------------------------------
+import collections
+import queue
+import threading
+import numpy as np
+import chunktune
+
+# Global variables.
+# ---------------------------------------------------------
+DEFAULT_CHUNK_SIZE = chunktune.DEFAULT_CHUNK_SIZE  # Used until the address has been tuned
+
+# NumPy dtypes matching :WAVeform:FORMat with :WAVeform:BYTeorder LSBFirst.
+# WORD is read signed (:WAVeform:UNSigned 0), BYTE unsigned (:WAVeform:UNSigned 1).
+WAVEFORM_DTYPES = {"WORD": np.dtype("<i2"), "BYTE": np.dtype("u1")}
+
+# Vertical resolution in bits of each :ACQuire:TYPE.
+ACQUISITION_BITS = {"NORM": 8, "PEAK": 8, "HRES": 12, "AVER": 16}
+
+# What the grab needs to know about one analog channel before :DATA?.
+# points is 0 if the channel is off or acquired nothing; preamble is
+# the :WAVeform:PREamble? reply as a tuple of 10 floats, or None.
+ChannelState = collections.namedtuple("ChannelState", ["channel", "displayed", "points", "preamble", "units"])
+
+
+# =========================================================
+# Pick BYTE or WORD for an acquisition type and precision:
+# =========================================================
+def choose_format(acq_type, precision_bits=None):
+    # acq_type is the :ACQuire:TYPE? reply.  precision_bits is the
+    # vertical resolution the caller needs, None for all the acquisition
+    # delivers.  NORMal and PEAK are 8 bit ADC data, so BYTE loses
+    # nothing and halves the transfer; HRESolution and AVERage keep WORD.
+    bits = ACQUISITION_BITS.get(acq_type.strip().upper()[:4], 16)
+    if precision_bits is not None:
+        bits = min(bits, precision_bits)
+    return "BYTE" if bits <= 8 else "WORD"
+
+
+# =========================================================
+# Set :WAVeform:FORMat and the matching byte order and sign:
+# =========================================================
+def configure_format(session, fmt):
+    # session may also be a ChannelStateCache, which then drops its
+    # preambles: their y increment and reference depend on the format.
+    # WORD codes are signed int16 and BYTE codes uint8, as in WAVEFORM_DTYPES.
+    session.write(":WAVeform:FORMat %s;BYTeorder LSBFirst;UNSigned %d" % (fmt, 1 if fmt == "BYTE" else 0))
+    return fmt
+
+
+# =========================================================
+# Allocate a (channels, points) buffer for raw sample codes:
+# =========================================================
+def allocate_waveform_buffer(points, channels=1, fmt="WORD"):
+    # One contiguous row per channel, so each channel can be read into
+    # its row directly.
+    return np.empty((channels, points), dtype=WAVEFORM_DTYPES[fmt])
+
+
+# =========================================================
+# Read a definite length IEEE 488.2 block into out:
+# =========================================================
+def read_ieee_block_into(session, out, chunk_size=DEFAULT_CHUNK_SIZE):
+    # out must be C-contiguous; returns the number of samples read.
+    # The caller has already sent the query and holds the session lock.
+    # chunk_size is the size of each VISA read.
+    if not out.flags.c_contiguous:
+        # reshape() would copy, and the data would never reach out.
+        raise ValueError("out must be C-contiguous to be read into")
+    raw = out.reshape(-1).view(np.uint8)
+    resource = getattr(session, "resource", session)
+    if not hasattr(resource, "read_bytes"):  # PyVisa < 1.9
+        return _read_ieee_block_raw(session, out, raw, chunk_size)
+
+    header = session.read_bytes(2)
+    if header[0:1] != b"#":
+        raise IOError("No start of block found")
+    nbytes = int(session.read_bytes(int(header[1:2])))
+    if nbytes > raw.nbytes:
+        # Read the rest of the reply, so the next query does not get it.
+        _discard(session, nbytes + 1, chunk_size)
+        raise ValueError("Block of %d bytes does not fit a %d byte buffer" % (nbytes, raw.nbytes))
+
+    # Only one chunk is ever held outside the buffer.
+    position = 0
+    while position < nbytes:
+        chunk = session.read_bytes(min(chunk_size, nbytes - position), chunk_size)
+        raw[position:position + len(chunk)] = np.frombuffer(chunk, dtype=np.uint8)
+        position += len(chunk)
+    session.read_bytes(1)  # Termination character, \n
+    return nbytes // out.itemsize
+
+
+def _read_ieee_block_raw(session, out, raw, chunk_size):
+    block = session.read_raw(chunk_size)
+    startpos = block.find(b"#")
+    if startpos < 0:
+        raise IOError("No start of block found")
+    digits = int(block[startpos + 1:startpos + 2])
+    nbytes = int(block[startpos + 2:startpos + 2 + digits])
+    offset = startpos + 2 + digits
+    # read_raw() has read the whole reply, so nothing is left to discard.
+    if nbytes > raw.nbytes:
+        raise ValueError("Block of %d bytes does not fit a %d byte buffer" % (nbytes, raw.nbytes))
+    raw[:nbytes] = np.frombuffer(block, dtype=np.uint8, count=nbytes, offset=offset)
+    return nbytes // out.itemsize
+
+
+def _discard(session, nbytes, chunk_size):
+    while nbytes > 0:
+        nbytes -= len(session.read_bytes(min(chunk_size, nbytes), chunk_size))
+
+
+# =========================================================
+# Fetch one source's waveform into a preallocated row:
+# =========================================================
+def fetch_waveform_into(session, source, out, chunk_size=None):
+    # source is e.g. "CHANnel1"; the format, byte order and points are
+    # whatever :WAVeform is currently set to, and out's dtype must match.
+    # chunk_size None uses the size tuned for this address (chunktune).
+    if chunk_size is None:
+        chunk_size = chunktune.chunk_size_for(session, DEFAULT_CHUNK_SIZE)
+    with session.lock:
+        session.write(":WAVeform:SOURce %s;DATA?" % source)
+        return read_ieee_block_into(session, out, chunk_size)
+
+
+# =========================================================
+# Tune the chunk size for session on a source's waveform data:
+# =========================================================
+def tune_chunk_size(session, source="CHANnel1", candidates=chunktune.CANDIDATE_CHUNK_SIZES,
+                    repeats=3, save=True):
+    # Transfers the source as :WAVeform is currently set up, so set the
+    # points to the record length normally used first.
+    with session.lock:
+        points = int(session.query(":WAVeform:SOURce %s;POINts?" % source))
+        fmt = session.query(":WAVeform:FORMat?").strip()
+        preamble = session.query(":WAVeform:PREamble?").split(",")
+    if int(float(preamble[1])) == 1:  # PEAK returns two values per point.
+        points *= 2
+    buffer = allocate_waveform_buffer(points, 1, fmt)[0]
+
+    def transfer(chunk_size):
+        return fetch_waveform_into(session, source, buffer, chunk_size) * buffer.itemsize
+
+    return chunktune.tune(session, transfer, candidates, repeats, save)
+
+
+# =========================================================
+# A fixed set of record buffers, reused from one fetch to the next:
+# =========================================================
+class BufferPool(object):
+    # get() blocks while every buffer is in use, which also bounds how
+    # far a producer can run ahead of its consumer.
+    def __init__(self, points, count=3, fmt="WORD"):
+        self.buffers = allocate_waveform_buffer(points, count, fmt)
+        self._free = queue.Queue()
+        for buffer in self.buffers:
+            self._free.put(buffer)
+
+    def get(self, timeout=None):
+        return self._free.get(timeout=timeout)
+
+    def put(self, buffer):
+        self._free.put(buffer)
+
+
+# Hands out the rows of a (sources, points) array in order and keeps
+# them, so every record is still there after the fetch.
+class _RowBuffers(object):
+    def __init__(self, array):
+        self._rows = iter(array)
+
+    def get(self, timeout=None):
+        return next(self._rows)
+
+    def put(self, buffer):
+        pass
+
+
+# =========================================================
+# Fetch several sources, processing each while the next transfers:
+# =========================================================
+def fetch_pipelined(session, sources, consumer, buffers, chunk_size=None, depth=2):
+    # The calling thread reads the sources one after another while a
+    # worker thread calls consumer(index, source, codes) on the records
+    # already read, with at most depth records waiting between the two.
+    # buffers is a BufferPool, whose buffers are recycled as soon as
+    # consumer returns, or an array with one row per source.  The first
+    # error from either side stops the pipeline and is raised here.
+    pool = _RowBuffers(buffers) if isinstance(buffers, np.ndarray) else buffers
+    pending = queue.Queue(maxsize=depth)
+    failure = []
+
+    def consume():
+        while True:
+            item = pending.get()
+            if item is None:
+                return
+            (index, source, buffer, count) = item
+            try:
+                if not failure:  # After an error, only drain and recycle.
+                    consumer(index, source, buffer[:count])
+            except Exception as e:
+                failure.append(e)
+            finally:
+                pool.put(buffer)
+
+    worker = threading.Thread(target=consume, name="waveform-consumer")
+    worker.daemon = True
+    worker.start()
+    try:
+        for (index, source) in enumerate(sources):
+            if failure:
+                break
+            buffer = pool.get()
+            count = fetch_waveform_into(session, source, buffer, chunk_size)
+            pending.put((index, source, buffer, count))
+    finally:
+        pending.put(None)
+        worker.join()
+    if failure:
+        raise failure[0]
+
+
+# =========================================================
+# Raw sample codes plus the vertical preamble:
+# =========================================================
+class Waveform(object):
+    # Holds the ADC codes as read (int16 for WORD, uint8 for BYTE) and
+    # converts to volts only when asked, with
+    #     volts = (code - y_reference) * y_increment + y_origin
+    # Keeping the codes is 4x smaller than float64 (2x for float32 out).
+    def __init__(self, codes, y_increment, y_origin, y_reference, units="VOLT", source=None):
+        self.codes = codes
+        self.y_increment = float(y_increment)
+        self.y_origin = float(y_origin)
+        self.y_reference = float(y_reference)
+        self.units = units
+        self.source = source
+
+    # preamble is the :WAVeform:PREamble? reply, as a string or already split.
+    @classmethod
+    def from_preamble(cls, codes, preamble, units="VOLT", source=None):
+        if isinstance(preamble, str):
+            preamble = preamble.split(",")
+        return cls(codes, preamble[7], preamble[8], preamble[9], units, source)
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes
+
+    # Offset of the folded scaling, volts = code * y_increment + offset.
+    @property
+    def offset(self):
+        return self.y_origin - self.y_reference * self.y_increment
+
+    # Scales into out if given (e.g. a column of a larger array), else
+    # into a new array of dtype.  Two passes over out and no
+    # temporaries the size of the record.
+    def scaled(self, dtype=np.float64, out=None):
+        if out is None:
+            out = np.empty(self.codes.shape, dtype=dtype)
+        np.multiply(self.codes, self.y_increment, out=out, casting="unsafe")
+        out += self.offset
+        return out
+
+    def __array__(self, dtype=None):
+        return self.scaled(np.float64 if dtype is None else dtype)
+
+    # Indexing scales only the selected samples: waveform[1000:2000]
+    def __getitem__(self, key):
+        codes = self.codes[key]
+        if np.ndim(codes) == 0:
+            return float(codes) * self.y_increment + self.offset
+        return codes * self.y_increment + self.offset
+
+    # Converts a voltage level to the nearest code, e.g. to threshold
+    # the raw record without scaling it.
+    def code_of(self, volts):
+        return (volts - self.offset) / self.y_increment
+
+
+# =========================================================
+# Time axis defined by the horizontal preamble:
+# =========================================================
+class TimeAxis(object):
+    # time[i] = (i // repeat - x_reference) * x_increment + x_origin
+    # repeat is 2 for PEAK acquisitions, which return a low and a high
+    # value per time point.  Values are computed only for the indices
+    # asked for, exactly as the full array (to_array()) would hold them.
+    def __init__(self, points, x_increment, x_origin, x_reference=0.0, repeat=1):
+        self.points = int(points)
+        self.x_increment = float(x_increment)
+        self.x_origin = float(x_origin)
+        self.x_reference = float(x_reference)
+        self.repeat = int(repeat)
+
+    # preamble is the :WAVeform:PREamble? reply, as a string or already split.
+    @classmethod
+    def from_preamble(cls, preamble):
+        if isinstance(preamble, str):
+            preamble = preamble.split(",")
+        repeat = 2 if int(float(preamble[1])) == 1 else 1  # Type 1 is PEAK.
+        return cls(int(float(preamble[2])), preamble[4], preamble[5], preamble[6], repeat)
+
+    def __len__(self):
+        return self.points * self.repeat
+
+    @property
+    def start(self):
+        return self._times(np.zeros(1))[0]
+
+    @property
+    def stop(self):
+        return self._times(np.array([self.points - 1.0]))[0]
+
+    # samples are point numbers as floats, before the repeat.
+    def _times(self, samples):
+        return ((samples - self.x_reference) * self.x_increment) + self.x_origin
+
+    def to_array(self, dtype=np.float64):
+        times = self._times(np.arange(self.points, dtype=np.float64))
+        if self.repeat > 1:
+            times = np.repeat(times, self.repeat)
+        return times.astype(dtype, copy=False)
+
+    def __array__(self, dtype=None):
+        return self.to_array(np.float64 if dtype is None else dtype)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            index = np.arange(*key.indices(len(self)))
+        else:
+            index = np.asarray(key)
+            if index.dtype == bool:
+                index = np.flatnonzero(index)
+            index = np.where(index < 0, index + len(self), index)
+            if np.any((index < 0) | (index >= len(self))):
+                raise IndexError("Time axis index out of range")
+        times = self._times((index // self.repeat).astype(np.float64))
+        return float(times) if times.ndim == 0 else times
+
+    # Index where times would be inserted to keep the axis sorted, like
+    # np.searchsorted(self.to_array(), times, side) for an increasing
+    # axis, without building the array.
+    def searchsorted(self, times, side="left"):
+        times = np.asarray(times, dtype=np.float64)
+        guess = np.ceil((times - self.x_origin) / self.x_increment + self.x_reference)
+        sample = np.clip(guess, 0, self.points).astype(np.int64)
+        # The guess can be one off through rounding; settle it against
+        # the exact values.
+        if side == "left":
+            inside = lambda sample_time: sample_time < times
+        else:
+            inside = lambda sample_time: sample_time <= times
+        below = sample > 0
+        sample -= below & ~inside(self._times(sample - 1.0))
+        sample += (sample < self.points) & inside(self._times(sample.astype(np.float64)))
+        index = sample * self.repeat
+        return int(index) if index.ndim == 0 else index
+
+    # Nearest index to a time, for picking out a point or a window.
+    def index_of(self, time):
+        return int(np.clip(self.searchsorted(time), 0, len(self) - 1))
+
+
+# =========================================================
+# Channel state and preamble cache:
+# =========================================================
+class ChannelStateCache(object):
+    # Commands that can change a channel state or preamble, as header
+    # node prefixes, so both short and long forms match.  :WAVeform:SOURce
+    # is not listed: it only turns a channel on if that channel is off,
+    # and the sources used here are channels that are displayed.
+    SETUP_HEADERS = [("*RST",), ("AUT",), ("CHAN",), ("TIM",), ("ACQ",), ("REC",),
+                     ("SYST", "SET"), ("WAV", "POIN"), ("WAV", "FORM"), ("WAV", "UNS"),
+                     ("WAV", "BYT")]
+
+    # verify=True checks a setup fingerprint (one chained query) before
+    # every cache hit, which also catches front panel changes.  With
+    # verify=False the cache trusts that every setup change goes through
+    # write() and costs no round trips at all.
+    def __init__(self, session, channels=4, verify=True):
+        self.session = session
+        self.channels = channels
+        self.verify = verify
+        self.hits = 0
+        self.misses = 0
+        self._states = None
+        self._fingerprint = None
+
+    # :WAVeform:POINts? is left out: it answers for the last source set,
+    # which _load_state() changes.  The points follow from the timebase,
+    # acquisition and points mode, which are all in the fingerprint.
+    def fingerprint(self):
+        parts = [":TIMebase:RANGe?;POSition?;REFerence?", ":ACQuire:TYPE?;COUNt?",
+                 ":WAVeform:FORMat?;UNSigned?;BYTeorder?;POINts:MODE?"]
+        for channel in range(1, self.channels + 1):
+            parts.append(":CHANnel%d:DISPlay?;RANGe?;OFFSet?;UNITs?;PROBe?" % channel)
+        return self.session.query(";".join(parts)).strip()
+
+    def states(self):
+        with self.session.lock:
+            fingerprint = self.fingerprint() if self.verify else None
+            if self._states is not None and fingerprint == self._fingerprint:
+                self.hits += 1
+                return self._states
+            self.misses += 1
+            self._states = [self._load_state(channel) for channel in range(1, self.channels + 1)]
+            self._fingerprint = fingerprint
+            return self._states
+
+    def _load_state(self, channel):
+        (displayed, units) = self.session.query(":CHANnel%d:DISPlay?;UNITs?" % channel).strip().split(";")
+        if int(displayed) != 1:
+            return ChannelState(channel, False, 0, None, units)
+        # Setting the source turns a channel on, so only displayed channels are asked.
+        reply = self.session.query(":WAVeform:SOURce CHANnel%d;POINts?;PREamble?" % channel)
+        (points, preamble) = reply.strip().split(";")
+        return ChannelState(channel, True, int(points),
+                            tuple(float(value) for value in preamble.split(",")), units)
+
+    def invalidate(self):
+        self._states = None
+        self._fingerprint = None
+
+    def note_command(self, command):
+        if any(_matches(header, prefixes) for header in _command_headers(command)
+               for prefixes in self.SETUP_HEADERS):
+            self.invalidate()
+
+    # Writes a command through the cache, so setup changes drop it.
+    def write(self, command):
+        with self.session.lock:
+            self.note_command(command)
+            return self.session.write(command)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+# =========================================================
+# Absolute, upper case headers of the commands in a message:
+# =========================================================
+def _command_headers(message):
+    # Queries are skipped; a header without a leading colon is relative
+    # to the previous one, e.g. ":WAVeform:FORMat WORD;POINts 1000".
+    path = []
+    for part in message.split(";"):
+        header = part.strip().split(" ", 1)[0].upper()
+        if not header:
+            continue
+        if header.startswith("*"):
+            nodes = [header]
+        elif header.startswith(":"):
+            nodes = header[1:].split(":")
+        else:
+            nodes = path + header.split(":")
+        if not header.startswith("*"):
+            path = nodes[:-1]
+        if not header.endswith("?"):
+            yield nodes
+
+
+def _matches(nodes, prefixes):
+    return (len(nodes) >= len(prefixes)
+            and all(node.startswith(prefix) for (node, prefix) in zip(nodes, prefixes)))
@@ -0,0 +1,264 @@
+# *********************************************************
+# Client-side waveform measurements: the parameters
+# measurev.analyze() asks the scope for (VMAX, VMIN, VPP,
+# VAMPlitude, VAVerage, FREQuency, PERiod) plus VTOP, VBASe,
+# rise and fall time and duty cycle, computed with NumPy from
+# downloaded waveforms.  Every row of a (..., points) array,
+# e.g. (captures, channels, points), is measured at once, so
+# a whole wavearchive can be re-measured offline.
+#
+# Usage: python wavemeasure.py ARCHIVE
+#   measures every capture of ARCHIVE.raw/.idx and saves the
+#   results to ARCHIVE_measurements.npz
+# *********************************************************
+# Import modules.
+# ---------------------------------------------------------
+import collections
+import numpy as np
+import wavearchive
+import waveform
+
+# Global variables.
+# ---------------------------------------------------------
+MEASUREMENTS = ["VMAX", "VMIN", "VPP", "VAMPlitude", "VAVerage", "FREQuency", "PERiod",
+                "VTOP", "VBASe", "RISetime", "FALLtime", "DUTYcycle"]
+DEFAULT_THRESHOLDS = (10.0, 50.0, 90.0)  # Lower, middle, upper, % of VAMPlitude above VBASe
+HISTOGRAM_BINS = 256
+TOP_BASE_MIN_FRACTION = 0.05  # Below this share of points, VTOP/VBASe fall back to VMAX/VMIN
+BLOCK_SAMPLES = 1 << 22  # Samples measured per pass, to bound the temporaries
+ARCHIVE_BATCH = 1024  # Captures per measure() call in measure_archive()
+
+# How each result is scaled from codes/samples to volts/seconds.
+LEVELS = ("VMAX", "VMIN", "VAVerage", "VTOP", "VBASe")
+SPANS = ("VPP", "VAMPlitude")
+TIMES = ("PERiod", "RISetime", "FALLtime")
+TIMING = TIMES + ("FREQuency", "DUTYcycle")
+
+
+# =========================================================
+# Voltage levels of each row:
+# =========================================================
+def _levels(values):
+    # VTOP and VBASe are the means of the most common histogram bin in
+    # the upper and lower half of the row's range, as the scope does it;
+    # without a clear flat top or base (sine, triangle) they are VMAX
+    # and VMIN.
+    (rows, points) = values.shape
+    vmax = values.max(axis=1).astype(np.float64)
+    vmin = values.min(axis=1).astype(np.float64)
+    span = vmax - vmin
+    scale = (HISTOGRAM_BINS - 1) / np.where(span > 0, span, np.inf)
+    bins = ((values - vmin[:, None]) * scale[:, None]).astype(np.intp)
+    bins += (np.arange(rows) * HISTOGRAM_BINS)[:, None]
+    counts = np.bincount(bins.ravel(), minlength=rows * HISTOGRAM_BINS).reshape(rows, -1)
+    sums = np.bincount(bins.ravel(), weights=values.ravel(), minlength=rows * HISTOGRAM_BINS).reshape(rows, -1)
+    del bins
+
+    row = np.arange(rows)
+    half = HISTOGRAM_BINS // 2
+    levels = []
+    for (mode, fallback) in [(half + np.argmax(counts[:, half:], axis=1), vmax),
+                             (np.argmax(counts[:, :half], axis=1), vmin)]:
+        count = counts[row, mode]
+        clear = count >= TOP_BASE_MIN_FRACTION * points
+        levels.append(np.where(clear, sums[row, mode] / np.maximum(count, 1), fallback))
+    (vtop, vbase) = levels
+    return {"VMAX": vmax, "VMIN": vmin, "VPP": span, "VAVerage": values.mean(axis=1, dtype=np.float64),
+            "VTOP": vtop, "VBASe": vbase, "VAMPlitude": vtop - vbase}
+
+
+# =========================================================
+# Fractional sample where y crosses level between k and k + 1:
+# =========================================================
+def _crossing(y, k, level):
+    y0 = y[k].astype(np.float64)
+    return k + (level - y0) / (y[k + 1] - y0)
+
+
+# =========================================================
+# Mean of weights per row, NaN for rows without any:
+# =========================================================
+def _row_mean(row, weights, rows):
+    count = np.bincount(row, minlength=rows)
+    total = np.bincount(row, weights=weights, minlength=rows)
+    return np.where(count > 0, total / np.maximum(count, 1), np.nan)
+
+
+# =========================================================
+# Mean period of each row from sorted edge times:
+# =========================================================
+def _row_period(row, times, rows):
+    # Average over all complete cycles: (last edge - first edge) / cycles.
+    period = np.full(rows, np.nan)
+    (present, first, count) = np.unique(row, return_index=True, return_counts=True)
+    cycles = count > 1
+    last = first + count - 1
+    period[present[cycles]] = (times[last[cycles]] - times[first[cycles]]) / (count[cycles] - 1)
+    return period
+
+
+# =========================================================
+# Rise/fall time, period and duty cycle of each row:
+# =========================================================
+def _timing(values, lower, middle, upper):
+    # Results are in samples.  Edges are found with hysteresis: a rising
+    # edge goes from at or below the lower threshold to at or above the
+    # upper one, so noise around the middle threshold adds no edges.
+    # Rise and fall times are averaged over all edges in the row.
+    (rows, points) = values.shape
+    y = values.ravel()
+    state = np.zeros(values.shape, dtype=np.int8)
+    state[values <= lower[:, None]] = -1
+    state[values >= upper[:, None]] = 1
+    outside = np.flatnonzero(state)
+    side = state.ravel()[outside]
+    del state
+    k = np.flatnonzero((side[1:] != side[:-1]) & (outside[1:] // points == outside[:-1] // points)) + 1
+    # The last sample on the old side and the first on the new one.
+    rising = (outside[k[side[k] == 1] - 1], outside[k[side[k] == 1]])
+    falling = (outside[k[side[k] == -1] - 1], outside[k[side[k] == -1]])
+
+    # Middle threshold crossings, as flat indices of the first sample past it.
+    above = values >= middle[:, None]
+    step = np.flatnonzero(above[:, 1:] != above[:, :-1])
+    step += step // (points - 1) + 1
+    up = step[above.ravel()[step]]
+    down = step[~above.ravel()[step]]
+    del above, step
+
+    edges = {}
+    for (name, (before, after), crossings, start, stop) in [
+            ("rise", rising, up, lower, upper), ("fall", falling, down, upper, lower)]:
+        row = after // points
+        duration = _crossing(y, after - 1, stop[row]) - _crossing(y, before, start[row])
+        # The first middle crossing after the edge leaves the old side.
+        m = crossings[np.searchsorted(crossings, before, side="right")]
+        edges[name] = (row, _crossing(y, m - 1, middle[row]), _row_mean(row, duration, rows))
+
+    (rise_row, rise_mid, rise_time) = edges["rise"]
+    (fall_row, fall_mid, fall_time) = edges["fall"]
+    period = _row_period(rise_row, rise_mid, rows)
+    period = np.where(np.isnan(period), _row_period(fall_row, fall_mid, rows), period)
+    # Positive width: each rising middle crossing to the next falling one
+    # in the same row.  Flat indices sort by row first, so one
+    # searchsorted pairs them for all rows.
+    following = np.searchsorted(fall_mid, rise_mid)
+    paired = following < len(fall_mid)
+    paired[paired] &= fall_row[following[paired]] == rise_row[paired]
+    width = _row_mean(rise_row[paired], fall_mid[following[paired]] - rise_mid[paired], rows)
+    return {"PERiod": period, "FREQuency": 1.0 / period, "RISetime": rise_time,
+            "FALLtime": fall_time, "DUTYcycle": 100.0 * width / period}
+
+
+# =========================================================
+# Measure every row of y:
+# =========================================================
+def measure(y, x_increment=1.0, names=None, thresholds=DEFAULT_THRESHOLDS,
+            y_increment=1.0, y_offset=0.0):
+    # y is an array of shape (..., points), in volts, or raw codes that
+    # are scaled as y_increment * code + y_offset (waveform.Waveform's
+    # offset), or a waveform.Waveform.  x_increment, y_increment and
+    # y_offset are scalars or arrays broadcasting to y.shape[:-1].
+    # Returns {name: array of shape y.shape[:-1]} for names (default
+    # MEASUREMENTS); timing results are NaN for rows without enough
+    # edges.  Raw codes are measured as they are and only the results
+    # are scaled.
+    if isinstance(y, waveform.Waveform):
+        (y, y_increment, y_offset) = (y.codes, y.y_increment, y.offset)
+    names = MEASUREMENTS if names is None else names
+    values = np.asarray(y)
+    lead = values.shape[:-1]
+    points = values.shape[-1]
+    values = values.reshape(-1, points)
+    rows = len(values)
+    timing = points > 2 and any(name in TIMING for name in names)
+
+    raw = dict((name, np.full(rows, np.nan)) for name in MEASUREMENTS)
+    (lower, middle, upper) = [percent / 100.0 for percent in thresholds]
+    step = max(1, BLOCK_SAMPLES // points)
+    for start in range(0, rows, step):
+        block = np.ascontiguousarray(values[start:start + step])
+        results = _levels(block)
+        if timing:
+            (base, amplitude) = (results["VBASe"], results["VAMPlitude"])
+            results.update(_timing(block, base + lower * amplitude, base + middle * amplitude,
+                                   base + upper * amplitude))
+        for (name, result) in results.items():
+            raw[name][start:start + len(block)] = result
+
+    (gain, offset, dt) = [np.broadcast_to(np.asarray(value, dtype=np.float64), lead).reshape(-1)
+                          for value in (y_increment, y_offset, x_increment)]
+    measurements = collections.OrderedDict()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for name in names:
+            value = raw[name]
+            if name in LEVELS:
+                value = value * gain + offset
+            elif name in SPANS:
+                value = value * gain
+            elif name in TIMES:
+                value = value * dt
+            elif name == "FREQuency":
+                value = value / dt
+            measurements[name] = value.reshape(lead)
+    return measurements
+
+
+# =========================================================
+# Measure the channels of one capture together:
+# =========================================================
+def measure_waveforms(waveforms, x_increment, names=None, thresholds=DEFAULT_THRESHOLDS):
+    # waveforms is a list of waveform.Waveform of equal length; results
+    # have one value per waveform.
+    return measure(np.stack([wave.codes for wave in waveforms]), x_increment, names, thresholds,
+                   [wave.y_increment for wave in waveforms], [wave.offset for wave in waveforms])
+
+
+# =========================================================
+# Measure every capture of a wavearchive.WaveformArchive:
+# =========================================================
+def measure_archive(archive, names=None, thresholds=DEFAULT_THRESHOLDS, batch=ARCHIVE_BATCH):
+    # Returns {name: array of shape (captures, MAX_CHANNELS)}, NaN where
+    # a capture has fewer channels; the channel order is that of
+    # archive.index["sources"].  Captures stored back to back with the
+    # same shape are measured batch at a time straight from the memory
+    # mapped archive.
+    names = MEASUREMENTS if names is None else names
+    index = archive.index
+    count = len(index)
+    results = collections.OrderedDict((name, np.full((count, wavearchive.MAX_CHANNELS), np.nan))
+                                      for name in names)
+    if count == 0:
+        return results
+    (channels, points, offset) = (index["channels"], index["points"], index["offset"])
+    joined = ((channels[1:] == channels[:-1]) & (points[1:] == points[:-1])
+              & (offset[1:] == offset[:-1] + channels[:-1].astype(np.int64) * points[:-1]))
+    starts = np.concatenate([[0], np.flatnonzero(~joined) + 1, [count]])
+    for (run_start, run_stop) in zip(starts[:-1], starts[1:]):
+        for first in range(run_start, run_stop, batch):
+            stop = min(first + batch, run_stop)
+            used = int(channels[first])
+            records = index[first:stop]
+            y_increment = records["y_increment"][:, :used]
+            y_offset = records["y_origin"][:, :used] - records["y_reference"][:, :used] * y_increment
+            # PEAK captures hold two samples per x_increment.
+            x_increment = (records["x_increment"] / records["repeat"])[:, None]
+            measured = measure(archive.block_codes(first, stop), x_increment,
+                               names, thresholds, y_increment, y_offset)
+            for name in names:
+                results[name][first:stop, :used] = measured[name]
+    return results
+
+
+# =========================================================
+# Main program: re-measure an archive
+# =========================================================
+if __name__ == '__main__':
+    import sys
+    path = sys.argv[1]
+    archive = wavearchive.WaveformArchive(path)
+    results = measure_archive(archive)
+    np.savez(path + "_measurements.npz", **results)
+    print("%d captures measured, saved to %s_measurements.npz" % (len(archive), path))
+    for name in MEASUREMENTS:
+        print("%-12s %s" % (name, " ".join("%14.6g" % value for value in np.nanmean(results[name], axis=0))))